@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from collections import Counter
+from typing import Optional
+
+from bot import bot
+from config import ADMIN_IDS, ADMIN_ALERT_INTERVAL
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Сколько разных ошибок показывать в одном сообщении и лимит длины сообщения Telegram
+MAX_ALERT_LINES = 20
+MAX_MESSAGE_LENGTH = 4096
+
+
+class AdminAlerts:
+    """
+    Уведомления администраторов об ошибках.
+
+    add() только запоминает текст и сразу возвращается, поэтому обработчик
+    не ждет отправки (в чат администратора Telegram пропускает не больше
+    сообщения в секунду). Накопленные за interval секунд тексты отправляются
+    одним сообщением; одинаковые схлопываются с указанием количества.
+    """
+
+    def __init__(self, interval: float = ADMIN_ALERT_INTERVAL) -> None:
+        self.interval = interval
+        self._pending: Counter = Counter()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, text: str) -> None:
+        """Добавляет текст в ближайшее уведомление"""
+        self._pending[text] += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._send_later())
+
+    def _render(self, pending: Counter) -> str:
+        lines = [text if count == 1 else f"{text} (×{count})" for text, count in pending.most_common(MAX_ALERT_LINES)]
+        if len(pending) > MAX_ALERT_LINES:
+            lines.append(f"... и еще {len(pending) - MAX_ALERT_LINES} разных ошибок")
+        return "\n".join(lines)[:MAX_MESSAGE_LENGTH]
+
+    async def _send_later(self) -> None:
+        try:
+            await asyncio.sleep(self.interval)
+        finally:
+            pending, self._pending = self._pending, Counter()
+            self._task = None
+        text = self._render(pending)
+        for admin_id in ADMIN_IDS:
+            try:
+                await bot.send_message(admin_id, text)
+            except Exception as e:
+                logger.warning(f"Не удалось отправить уведомление администратору {admin_id}: {e}")
+
+
+admin_alerts = AdminAlerts()
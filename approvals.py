@@ -0,0 +1,219 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from sqlalchemy import select, update, func, distinct
+
+from bot import bot
+from broadcast import TokenBucket, broadcast
+from buffers import WriteBehindBuffer, chunked
+from config import APPROVE_RATE, APPROVE_CONCURRENCY
+from db.models import Session, ReadSession, SubscriptionRequest, User
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Результаты одобрения запроса (NULL в БД - запрос ожидает одобрения)
+APPROVED = "approved"
+MISSING = "missing"  # Запрос уже не существует (отозван или обработан вручную)
+FAILED = "failed"
+
+# Как часто сообщать о ходе одобрения (секунды)
+PROGRESS_INTERVAL = 3
+
+# Отдельный лимит, чтобы одобрение не отнимало скорость у рассылок
+approve_bucket = TokenBucket(APPROVE_RATE)
+
+# Каналы, по которым сейчас идет одобрение
+running_channels: Set[int] = set()
+
+# Вызывается с количеством одобренных, неудачных и общим количеством
+ProgressFunc = Callable[[int, int, int], Awaitable[None]]
+
+
+class ApprovalStatusBuffer(WriteBehindBuffer):
+    """Буфер результатов одобрения запросов в один канал"""
+
+    def __init__(self, channel_id: int, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.channel_id = channel_id
+        self._statuses: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._statuses)
+
+    def set_status(self, user_id: int, status: str) -> None:
+        self._statuses[user_id] = status
+        self._added()
+
+    def _take(self) -> Dict[int, str]:
+        batch, self._statuses = self._statuses, {}
+        return batch
+
+    def _restore(self, batch: Dict[int, str]) -> None:
+        self._statuses = {**batch, **self._statuses}
+
+    async def _write(self, batch: Dict[int, str]) -> None:
+        async with Session() as db:
+            for status in set(batch.values()):
+                user_ids = [user_id for user_id, value in batch.items() if value == status]
+                for chunk in chunked(user_ids):
+                    await db.execute(
+                        update(SubscriptionRequest)
+                        .where(
+                            SubscriptionRequest.channel_id == self.channel_id,
+                            SubscriptionRequest.user_id.in_(chunk),
+                            SubscriptionRequest.approve_status.is_(None),
+                        )
+                        .values(approve_status=status)
+                        .execution_options(synchronize_session=False)
+                    )
+            await db.commit()
+
+
+def _pending_query(channel_id: int, only_captcha: bool):
+    """Запрос ID пользователей с ожидающими одобрения запросами в канал"""
+    query = (
+        select(SubscriptionRequest.user_id)
+        .where(SubscriptionRequest.channel_id == channel_id, SubscriptionRequest.approve_status.is_(None))
+        .distinct()
+    )
+    if only_captcha:
+        query = (
+            query.join(User, User.id == SubscriptionRequest.user_id)
+            .where(User.captcha_passed_at.is_not(None))
+        )
+    return query
+
+
+async def list_pending_channels() -> List[Tuple[int, Optional[str], int]]:
+    """Возвращает каналы с ожидающими запросами: (ID, название, количество пользователей)"""
+    async with ReadSession() as db:
+        result = await db.execute(
+            select(
+                SubscriptionRequest.channel_id,
+                func.max(SubscriptionRequest.channel_name),
+                func.count(distinct(SubscriptionRequest.user_id)),
+            )
+            .where(SubscriptionRequest.approve_status.is_(None))
+            .group_by(SubscriptionRequest.channel_id)
+        )
+        return result.all()
+
+
+async def count_pending(channel_id: int, only_captcha: bool) -> int:
+    """Возвращает количество пользователей, ожидающих одобрения в канал"""
+    async with ReadSession() as db:
+        return await db.scalar(select(func.count()).select_from(_pending_query(channel_id, only_captcha).subquery()))
+
+
+async def iter_pending_requests(channel_id: int, only_captcha: bool, chunk_size: int = 1000) -> AsyncIterator[int]:
+    """Выдает ID пользователей, ожидающих одобрения, порциями по chunk_size (по возрастанию ID)"""
+    last_user_id = None
+    while True:
+        query = _pending_query(channel_id, only_captcha).order_by(SubscriptionRequest.user_id).limit(chunk_size)
+        if last_user_id is not None:
+            query = query.where(SubscriptionRequest.user_id > last_user_id)
+        async with ReadSession() as db:
+            user_ids = (await db.execute(query)).scalars().all()
+        if not user_ids:
+            return
+        for user_id in user_ids:
+            yield user_id
+        last_user_id = user_ids[-1]
+
+
+def _status_for_error(error: Exception) -> Optional[str]:
+    """
+    Определяет результат одобрения по ошибке Telegram.
+
+    Для временных ошибок (лимит, сеть) возвращает None: запрос остается
+    ожидающим и будет обработан при повторном запуске.
+    """
+    if not isinstance(error, TelegramBadRequest):
+        return None
+    if "USER_ALREADY_PARTICIPANT" in error.message:
+        return APPROVED
+    if "HIDE_REQUESTER_MISSING" in error.message:
+        return MISSING
+    return FAILED
+
+
+def claim_channel(channel_id: int) -> bool:
+    """
+    Отмечает канал как обрабатываемый. Возвращает False, если одобрение
+    в него уже идет. Проверка и отметка выполняются без переключения задач,
+    поэтому два одновременных нажатия не запустят одобрение дважды.
+    """
+    if channel_id in running_channels:
+        return False
+    running_channels.add(channel_id)
+    return True
+
+
+async def approve_requests(channel_id: int, only_captcha: bool, progress: Optional[ProgressFunc] = None,
+                           claimed: bool = False) -> Tuple[int, int]:
+    """
+    Одобряет все ожидающие запросы на вступление в канал.
+
+    Запросы одобряются параллельно через approve_chat_join_request с общим
+    ограничением скорости approve_bucket. Результат каждого запроса
+    сохраняется в subscription_requests.approve_status, поэтому после
+    прерывания повторный запуск обработает только оставшиеся запросы.
+
+    Параметры:
+        channel_id: ID канала
+        only_captcha: одобрять только пользователей, нажавших "Я человек!"
+        progress: вызывается каждые PROGRESS_INTERVAL секунд и в конце
+        claimed: канал уже отмечен вызывающим через claim_channel
+            (отметка в любом случае снимается по завершении)
+
+    Возвращает:
+        Tuple[int, int]: количество одобренных и неудачных запросов
+    """
+    if not claimed and not claim_channel(channel_id):
+        raise RuntimeError(f"Одобрение заявок в канал {channel_id} уже запущено")
+
+    statuses = ApprovalStatusBuffer(channel_id)
+    counts = {"approved": 0, "failed": 0}
+    total = 0
+
+    async def on_sent(user_id: int) -> None:
+        counts["approved"] += 1
+        statuses.set_status(user_id, APPROVED)
+
+    async def on_error(user_id: int, error: Exception) -> None:
+        status = _status_for_error(error)
+        # Пользователь уже в канале - запрос считается одобренным
+        counts["approved" if status == APPROVED else "failed"] += 1
+        if status:
+            statuses.set_status(user_id, status)
+
+    async def report_progress() -> None:
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            await progress(counts["approved"], counts["failed"], total)
+
+    reporter = None
+    try:
+        statuses.start()
+        total = await count_pending(channel_id, only_captcha)
+        reporter = asyncio.create_task(report_progress()) if progress else None
+        await broadcast(
+            iter_pending_requests(channel_id, only_captcha),
+            lambda user_id: bot.approve_chat_join_request(chat_id=channel_id, user_id=user_id),
+            on_error=on_error,
+            on_sent=on_sent,
+            concurrency=APPROVE_CONCURRENCY,
+            limiter=approve_bucket,
+            kind="approve",
+        )
+    finally:
+        if reporter:
+            reporter.cancel()
+        await statuses.stop()
+        running_channels.discard(channel_id)
+
+    if progress:
+        await progress(counts["approved"], counts["failed"], total)
+    return counts["approved"], counts["failed"]
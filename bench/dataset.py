@@ -0,0 +1,78 @@
+"""
+Генерация синтетической базы для нагрузочного тестирования:
+пользователи и запросы на подписку в нескольких каналах.
+"""
+import datetime
+import random
+from typing import List
+
+from sqlalchemy import insert, func, select
+
+from db.models import Session, User, SubscriptionRequest, create_tables
+
+# Количество строк в одной транзакции вставки
+INSERT_CHUNK_SIZE = 20000
+
+# ID синтетических пользователей начинаются отсюда, чтобы не пересекаться с ADMIN_IDS
+USER_ID_BASE = 10 ** 9
+
+
+def channel_ids(channels: int) -> List[int]:
+    return [-1001000000000 - i for i in range(channels)]
+
+
+async def generate(users: int, rows: int, channels: int = 3, blocked_rate: float = 0.05,
+                   captcha_rate: float = 0.7, seed: int = 0) -> None:
+    """
+    Заполняет БД синтетическими данными (если в ней еще нет пользователей).
+
+    Параметры:
+        users: количество пользователей
+        rows: количество запросов на подписку (распределяются по пользователям и каналам)
+        channels: количество каналов
+        blocked_rate: доля пользователей, заблокировавших бота
+        captcha_rate: доля пользователей, нажавших "Я человек!"
+        seed: зерно генератора
+    """
+    await create_tables()
+    async with Session() as db:
+        if await db.scalar(select(func.count()).select_from(User)):
+            return
+
+    rnd = random.Random(seed)
+    now = datetime.datetime.now()
+    channel_list = channel_ids(channels)
+
+    for start in range(0, users, INSERT_CHUNK_SIZE):
+        batch = []
+        for i in range(start, min(users, start + INSERT_CHUNK_SIZE)):
+            batch.append({
+                "id": USER_ID_BASE + i,
+                "username": f"user{i}",
+                "first_name": f"First {i}",
+                "last_name": None,
+                "is_blocked": rnd.random() < blocked_rate,
+                "captcha_passed_at": now if rnd.random() < captcha_rate else None,
+                "created_at": now,
+            })
+        async with Session() as db:
+            await db.execute(insert(User), batch)
+            await db.commit()
+
+    for start in range(0, rows, INSERT_CHUNK_SIZE):
+        batch = []
+        for i in range(start, min(rows, start + INSERT_CHUNK_SIZE)):
+            user_index = i % users
+            channel_id = channel_list[(i // users) % channels]
+            batch.append({
+                "user_id": USER_ID_BASE + user_index,
+                "username": f"user{user_index}",
+                "first_name": f"First {user_index}",
+                "last_name": None,
+                "channel_id": channel_id,
+                "channel_name": f"Channel {channel_id}",
+                "time_request": now - datetime.timedelta(seconds=rnd.randrange(90 * 24 * 3600)),
+            })
+        async with Session() as db:
+            await db.execute(insert(SubscriptionRequest), batch)
+            await db.commit()
@@ -0,0 +1,100 @@
+"""
+Локальная замена Telegram Bot API для нагрузочного тестирования.
+
+Принимает запросы вида POST /bot<token>/<method> и отвечает как Telegram:
+с задержкой latency, долей ответов 429 (retry_after) и долей получателей,
+заблокировавших бота (403 Forbidden). Заблокированные получатели выбираются
+детерминированно по chat_id, поэтому результат повторяется от запуска к запуску.
+"""
+import asyncio
+import random
+import time
+from collections import Counter
+from typing import Optional
+
+from aiohttp import web
+
+
+class FakeTelegramAPI:
+    """
+    aiohttp-сервер, имитирующий Bot API.
+
+    Параметры:
+        latency: задержка ответа (секунды)
+        retry_after_rate: доля запросов, на которые отвечается 429
+        retry_after: значение retry_after в ответе 429 (секунды)
+        forbidden_rate: доля chat_id, для которых отправка заканчивается 403
+        seed: зерно генератора для ответов 429
+    """
+
+    def __init__(self, latency: float = 0.0, retry_after_rate: float = 0.0, retry_after: int = 1,
+                 forbidden_rate: float = 0.0, seed: int = 0) -> None:
+        self.latency = latency
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.forbidden_rate = forbidden_rate
+        self.requests: Counter = Counter()
+        self.responses: Counter = Counter()
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    def is_forbidden(self, chat_id: int) -> bool:
+        """Заблокировал ли бота получатель chat_id"""
+        return chat_id % 1000 < self.forbidden_rate * 1000
+
+    def _result(self, method: str, data: dict):
+        if method.lower() == "getme":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if method.lower().startswith(("send", "copy")):
+            return {
+                "message_id": self.requests[method],
+                "date": int(time.time()),
+                "chat": {"id": int(data.get("chat_id", 0)), "type": "private"},
+                "text": data.get("text", ""),
+            }
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = dict(await request.post())
+        self.requests[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.retry_after_rate and self._random.random() < self.retry_after_rate:
+            self.responses["429"] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        chat_id = data.get("chat_id")
+        if chat_id is not None and self.is_forbidden(int(chat_id)):
+            self.responses["403"] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 403,
+                "description": "Forbidden: bot was blocked by the user",
+            }, status=403)
+
+        self.responses["200"] += 1
+        return web.json_response({"ok": True, "result": self._result(method, data)})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запускает сервер и возвращает его адрес (порт 0 - любой свободный)"""
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host=host, port=port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,259 @@
+"""
+Нагрузочный тест бота без обращения к Telegram.
+
+Запускает локальную замену Bot API (bench/fake_api.py), создает синтетическую
+базу (bench/dataset.py) и прогоняет через настоящий Dispatcher волны
+запросов на вступление, нажатий "Я человек!" и блокировок бота, затем
+рассылку и выгрузку. Печатает скорость приема запросов, скорость рассылки,
+время выгрузки и пиковое потребление памяти.
+
+Пример (из корня проекта):
+
+    python -m bench.run --users 100000 --rows 1000000 --storm 20000 \\
+        --latency 0.05 --forbidden-rate 0.05 --json bench_result.json
+
+Результаты с --json удобно сравнивать между коммитами.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List
+
+logger: logging.Logger = logging.getLogger("bench")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с локальной заменой Telegram Bot API")
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "bot_bench.db"),
+                        help="файл SQLite для теста (по умолчанию пересоздается)")
+    parser.add_argument("--keep-db", action="store_true", help="не пересоздавать базу, если она уже есть")
+    parser.add_argument("--users", type=int, default=20000, help="пользователей в синтетической базе")
+    parser.add_argument("--rows", type=int, default=100000, help="запросов на подписку в синтетической базе")
+    parser.add_argument("--channels", type=int, default=3, help="количество каналов")
+    parser.add_argument("--storm", type=int, default=5000, help="событий в каждой волне обновлений")
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременно обрабатываемых обновлений")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка ответа Bot API (секунды)")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429 (секунды)")
+    parser.add_argument("--forbidden-rate", type=float, default=0.05, help="доля получателей с ответом 403")
+    parser.add_argument("--broadcast-rate", type=float, default=1000,
+                        help="лимит скорости рассылки (BROADCAST_RATE) на время теста")
+    parser.add_argument("--skip", nargs="*", default=[], choices=["storm", "broadcast", "export"],
+                        help="пропустить этапы")
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    return parser.parse_args()
+
+
+def configure_env(args: argparse.Namespace) -> None:
+    """
+    Настраивает окружение до импорта модулей бота (config читает его при импорте):
+    отдельная база, отключенный сервер метрик и заданный лимит рассылки
+    (он же - общий лимит исходящих сообщений).
+    """
+    if not args.keep_db:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    os.environ["DB_URL"] = f"sqlite+aiosqlite:///{os.path.abspath(args.db)}"
+    os.environ.pop("DB_READ_URL", None)
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["BROADCAST_RATE"] = str(args.broadcast_rate)
+    os.environ["OUTBOUND_RATE"] = str(args.broadcast_rate)
+    os.environ.setdefault("TG_TOKEN", "123456:bench")
+    os.environ.setdefault("ADMIN_IDS", "1")
+
+
+def peak_rss_mb() -> float:
+    """Пиковое потребление памяти процессом (МБ)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def timed(coro: Awaitable) -> float:
+    started = time.perf_counter()
+    await coro
+    return time.perf_counter() - started
+
+
+def join_request_update(update_id: int, user_id: int, channel_id: int) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"Storm {user_id}", "username": f"storm{user_id}"}
+    return {
+        "update_id": update_id,
+        "chat_join_request": {
+            "chat": {"id": channel_id, "type": "channel", "title": f"Channel {channel_id}"},
+            "from": user,
+            "user_chat_id": user_id,
+            "date": int(time.time()),
+        },
+    }
+
+
+def captcha_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"Storm {user_id}"},
+            "text": "👤 Я человек!",
+        },
+    }
+
+
+def block_update(update_id: int, user_id: int) -> dict:
+    bot_user = {"id": 1, "is_bot": True, "first_name": "bench"}
+    return {
+        "update_id": update_id,
+        "my_chat_member": {
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"Storm {user_id}"},
+            "date": int(time.time()),
+            "old_chat_member": {"status": "member", "user": bot_user},
+            "new_chat_member": {"status": "kicked", "user": bot_user, "until_date": 0},
+        },
+    }
+
+
+async def replay(dp, bot, updates: List[dict], concurrency: int, flush: Callable[[], Awaitable[None]],
+                 errors: Counter) -> float:
+    """
+    Прогоняет обновления через Dispatcher (не более concurrency одновременно)
+    и ждет сохранения буферов. Возвращает скорость обработки (обновлений в секунду).
+
+    Ошибки обработчиков не прерывают прогон, как и при обычном polling, но
+    считаются в errors: "forbidden" - ожидаемые 403 от получателей, которых
+    замена Bot API считает заблокировавшими бота, "other" - все остальные
+    (первая из них пишется в лог с трассировкой).
+    """
+    from aiogram.exceptions import TelegramForbiddenError
+    from aiogram.types import Update
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def feed(raw: dict) -> None:
+        async with semaphore:
+            try:
+                await dp.feed_update(bot, Update.model_validate(raw, context={"bot": bot}))
+            except TelegramForbiddenError:
+                errors["forbidden"] += 1
+            except Exception:
+                if not errors["other"]:
+                    logger.exception("Ошибка обработчика")
+                errors["other"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(raw) for raw in updates))
+    await flush()
+    return len(updates) / (time.perf_counter() - started)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, float]:
+    from aiogram import Dispatcher
+    from aiogram.client.telegram import TelegramAPIServer
+
+    import handlers_admin
+    import handlers_user
+    from bench.dataset import generate, channel_ids, USER_ID_BASE
+    from bench.fake_api import FakeTelegramAPI
+    from bot import bot
+    from buffers import user_status_buffer, join_request_buffer
+    from channel_links import channel_link_cache
+    from export import export_subscriptions
+    from mailing import MailingPayload, create_job, fill_job, run_job
+    from scheduler import follow_up_scheduler
+
+    logging.basicConfig(level=logging.WARNING)
+    results: Dict[str, float] = {}
+    errors: Counter = Counter()
+
+    api = FakeTelegramAPI(latency=args.latency, retry_after_rate=args.retry_after_rate,
+                          retry_after=args.retry_after, forbidden_rate=args.forbidden_rate)
+    bot.session.api = TelegramAPIServer.from_base(await api.start())
+
+    results["dataset_seconds"] = await timed(generate(args.users, args.rows, args.channels))
+    await channel_link_cache.load()
+    user_status_buffer.start()
+    join_request_buffer.start()
+    await follow_up_scheduler.start()
+
+    dp = Dispatcher()
+    dp.include_router(handlers_admin.router)
+    dp.include_router(handlers_user.router)
+
+    try:
+        if "storm" not in args.skip:
+            storm_users = [USER_ID_BASE + args.users + i for i in range(args.storm)]
+            channel_id = channel_ids(1)[0]
+            results["join_requests_per_second"] = await replay(
+                dp, bot, [join_request_update(i, user_id, channel_id) for i, user_id in enumerate(storm_users)],
+                args.concurrency, join_request_buffer.flush, errors,
+            )
+            results["captcha_per_second"] = await replay(
+                dp, bot, [captcha_update(i, user_id) for i, user_id in enumerate(storm_users)],
+                args.concurrency, user_status_buffer.flush, errors,
+            )
+            results["block_events_per_second"] = await replay(
+                dp, bot, [block_update(i, user_id) for i, user_id in enumerate(storm_users)],
+                args.concurrency, user_status_buffer.flush, errors,
+            )
+
+        if "broadcast" not in args.skip:
+            started = time.perf_counter()
+            job_id = await create_job(MailingPayload(text="Нагрузочный тест"), admin_id=1)
+            await fill_job(job_id)
+            results["broadcast_prepare_seconds"] = time.perf_counter() - started
+            requests_before = api.requests["sendMessage"]
+            started = time.perf_counter()
+            await run_job(job_id)
+            elapsed = time.perf_counter() - started
+            results["broadcast_requests"] = api.requests["sendMessage"] - requests_before
+            results["broadcast_messages_per_second"] = results["broadcast_requests"] / elapsed
+
+        if "export" not in args.skip:
+            for fmt in ("xlsx", "csv"):
+                started = time.perf_counter()
+                path = await export_subscriptions(fmt)
+                results[f"export_{fmt}_seconds"] = time.perf_counter() - started
+                results[f"export_{fmt}_mb"] = os.path.getsize(path) / 1024 / 1024
+                os.remove(path)
+    finally:
+        await follow_up_scheduler.stop()
+        await join_request_buffer.stop()
+        await user_status_buffer.stop()
+        await bot.session.close()
+        await api.stop()
+
+    results["handler_forbidden"] = errors["forbidden"]
+    results["handler_errors"] = errors["other"]
+    results["api_429_responses"] = api.responses["429"]
+    results["api_403_responses"] = api.responses["403"]
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def main() -> None:
+    args = parse_args()
+    configure_env(args)
+    results = asyncio.run(run(args))
+
+    width = max(len(name) for name in results)
+    for name, value in results.items():
+        print(f"{name:<{width}}  {value:,.2f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"args": vars(args), "results": results}, file, ensure_ascii=False, indent=2)
+    # Упавшие обработчики делают замер скорости недостоверным
+    if results["handler_errors"]:
+        print(f"Ошибок обработчиков: {results['handler_errors']:.0f}, результаты недостоверны", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Микро-бенчмарк HTTP-сессии Bot API.
+
+Отправляет одинаковый поток sendMessage в локальную замену Bot API
+(bench/fake_api.py) через сессию aiogram по умолчанию и через сессию из
+bot.create_session() и печатает скорость (запросов в секунду) для каждой.
+Замена работает по HTTP на localhost, поэтому то, ради чего настроен пул
+(повторное использование TLS-соединений, кэш DNS), здесь не проявляется:
+бенчмарк проверяет, что настроенная сессия не медленнее стандартной.
+
+Пример (из корня проекта):
+
+    python -m bench.session --requests 20000 --concurrency 20 --latency 0.01
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Callable, Dict
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Сравнение HTTP-сессий Bot API на локальной замене Telegram")
+    parser.add_argument("--requests", type=int, default=10000, help="запросов на каждую сессию")
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="одновременных запросов (по умолчанию BROADCAST_CONCURRENCY)")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа Bot API (секунды)")
+    parser.add_argument("--rounds", type=int, default=3, help="повторов; печатается лучший результат")
+    return parser.parse_args()
+
+
+async def measure(api_url: str, make_session: Callable, requests: int, concurrency: int) -> float:
+    """Отправляет requests сообщений не более concurrency одновременно. Возвращает запросов в секунду"""
+    from aiogram import Bot
+    from aiogram.client.telegram import TelegramAPIServer
+
+    session = make_session()
+    session.api = TelegramAPIServer.from_base(api_url)
+    bot = Bot(token="123456:bench", session=session)
+    semaphore = asyncio.Semaphore(concurrency)
+    text = "Сообщение рассылки с кнопкой " * 10
+
+    async def send(chat_id: int) -> None:
+        async with semaphore:
+            await bot.send_message(chat_id, text)
+
+    try:
+        # Прогрев: открываем соединения до начала замера
+        await asyncio.gather(*(send(chat_id) for chat_id in range(concurrency)))
+        started = time.perf_counter()
+        await asyncio.gather(*(send(chat_id) for chat_id in range(requests)))
+        return requests / (time.perf_counter() - started)
+    finally:
+        await bot.session.close()
+
+
+async def run(args: argparse.Namespace) -> Dict[str, float]:
+    from aiogram.client.session.aiohttp import AiohttpSession
+
+    from bench.fake_api import FakeTelegramAPI
+    from bot import create_session
+    from config import BROADCAST_CONCURRENCY
+
+    concurrency = args.concurrency or BROADCAST_CONCURRENCY
+    api = FakeTelegramAPI(latency=args.latency)
+    api_url = await api.start()
+    results: Dict[str, float] = {}
+    try:
+        for name, make_session in (("default", AiohttpSession), ("tuned", create_session)):
+            results[f"{name}_requests_per_second"] = max([
+                await measure(api_url, make_session, args.requests, concurrency) for _ in range(args.rounds)
+            ])
+    finally:
+        await api.stop()
+    results["speedup"] = results["tuned_requests_per_second"] / results["default_requests_per_second"]
+    return results
+
+
+def main() -> None:
+    args = parse_args()
+    os.environ.setdefault("TG_TOKEN", "123456:bench")
+    results = asyncio.run(run(args))
+    width = max(len(name) for name in results)
+    for name, value in results.items():
+        print(f"{name:<{width}}  {value:,.2f}")
+
+
+if __name__ == "__main__":
+    main()
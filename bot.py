@@ -1,6 +1,68 @@
 from aiogram import Bot
-from config import TG_TOKEN
-from typing import Optional
+from aiogram.client.session.aiohttp import AiohttpSession
+from config import TG_TOKEN, BOT_API_CONNECTIONS, BOT_API_DNS_TTL, BOT_API_KEEPALIVE, BOT_API_TIMEOUT
+from outbound import outbound_scheduler
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:  # orjson не обязателен, без него используется стандартный json
+    orjson = None
+
+
+def _orjson_dumps(obj: Any) -> str:
+    # aiogram ожидает строку, orjson возвращает bytes
+    return orjson.dumps(obj).decode()
+
+
+class TunedAiohttpSession(AiohttpSession):
+    """
+    Сессия Bot API с настроенным пулом соединений.
+
+    Дополняет параметры соединения aiogram (в том числе через прокси): пул
+    ограничен connections соединениями, и столько же к одному хосту - все
+    запросы идут на api.telegram.org; адрес кэшируется на BOT_API_DNS_TTL
+    секунд, простаивающее соединение держится BOT_API_KEEPALIVE секунд, поэтому
+    между волнами рассылки не приходится заново устанавливать TLS-соединения.
+    """
+
+    def __init__(self, connections: int = BOT_API_CONNECTIONS, **kwargs: Any) -> None:
+        self.connections = connections
+        super().__init__(limit=connections, **kwargs)
+        self._tune_connector()
+
+    def _setup_proxy_connector(self, proxy: Any) -> None:
+        # Прокси заменяет параметры соединения целиком - дополняем и их
+        super()._setup_proxy_connector(proxy)
+        self._tune_connector()
+
+    def _tune_connector(self) -> None:
+        self._connector_init.update(
+            limit=self.connections,
+            limit_per_host=self.connections,
+            ttl_dns_cache=BOT_API_DNS_TTL,
+            keepalive_timeout=BOT_API_KEEPALIVE,
+        )
+
+
+def create_session(connections: int = BOT_API_CONNECTIONS, timeout: float = BOT_API_TIMEOUT) -> AiohttpSession:
+    """
+    Создает HTTP-сессию для запросов к Bot API.
+
+    Если установлен orjson, он используется для кодирования и разбора JSON.
+
+    Параметры:
+        connections: максимальное число одновременных соединений
+        timeout: таймаут одного запроса (секунды)
+
+    Возвращает:
+        AiohttpSession: сессия, которую нужно закрыть при остановке (bot.session.close())
+    """
+    json_options = {"json_loads": orjson.loads, "json_dumps": _orjson_dumps} if orjson else {}
+    return TunedAiohttpSession(connections, timeout=timeout, **json_options)
+
 
 # Инициализация бота Telegram
-bot: Optional[Bot] = Bot(token=TG_TOKEN)
+bot: Optional[Bot] = Bot(token=TG_TOKEN, session=create_session())
+# Все отправки сообщений идут через общую очередь с приоритетами и лимитами Telegram
+bot.session.middleware(outbound_scheduler)
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import AsyncIterable, Awaitable, Callable, Iterable, Optional, Union
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+
+from config import BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_MAX_RETRIES
+from metrics import broadcast_messages
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+SendFunc = Callable[[int], Awaitable[object]]
+SentFunc = Callable[[int], Awaitable[None]]
+ErrorFunc = Callable[[int, Exception], Awaitable[None]]
+Recipients = Union[Iterable[int], AsyncIterable[int]]
+
+# Типы ошибок отправки
+ERROR_BLOCKED = "blocked"  # Пользователь заблокировал бота (Forbidden)
+ERROR_NOT_FOUND = "not_found"  # Чат не найден
+ERROR_RETRY_AFTER = "retry_after"  # Лимит Telegram не снялся за все попытки
+ERROR_OTHER = "other"
+
+
+def classify_error(error: Exception) -> str:
+    """Определяет тип ошибки отправки"""
+    if isinstance(error, TelegramForbiddenError):
+        return ERROR_BLOCKED
+    if isinstance(error, TelegramRetryAfter):
+        return ERROR_RETRY_AFTER
+    if isinstance(error, TelegramBadRequest) and "chat not found" in error.message.lower():
+        return ERROR_NOT_FOUND
+    return ERROR_OTHER
+
+
+class TokenBucket:
+    """
+    Глобальный ограничитель скорости отправки (token bucket).
+
+    Токены пополняются со скоростью rate в секунду, но не больше capacity.
+    Ожидающие отправители обслуживаются по очереди, поэтому суммарная
+    скорость всех рассылок не превышает rate.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Останавливает выдачу токенов на seconds секунд (ответ 429 от Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self._updated = self._paused_until
+
+    async def acquire(self) -> None:
+        """Ждет, пока не появится свободный токен, и забирает его"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                elapsed = max(0.0, now - self._updated)
+                self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Общий лимит на все рассылки бота
+bucket = TokenBucket(BROADCAST_RATE)
+
+
+@dataclass
+class BroadcastResult:
+    """Итог рассылки"""
+    sent: int = 0
+    failed: int = 0
+    errors: Counter = field(default_factory=Counter)  # Количество ошибок по типам
+
+
+async def _iterate(recipients: Recipients) -> AsyncIterable[int]:
+    """Приводит обычный и асинхронный итератор получателей к одному виду"""
+    if hasattr(recipients, "__aiter__"):
+        async for user_id in recipients:
+            yield user_id
+    else:
+        for user_id in recipients:
+            yield user_id
+
+
+async def broadcast(
+        recipients: Recipients,
+        send: SendFunc,
+        on_error: Optional[ErrorFunc] = None,
+        on_sent: Optional[SentFunc] = None,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        limiter: TokenBucket = bucket,
+        kind: str = "mailing",
+) -> BroadcastResult:
+    """
+    Отправляет сообщение всем получателям пулом параллельных отправителей.
+
+    Каждая отправка берет токен из общего limiter. При TelegramRetryAfter
+    выдача токенов приостанавливается для всех отправителей, а получатель
+    отправляется повторно (не более BROADCAST_MAX_RETRIES раз).
+
+    Параметры:
+        recipients: ID получателей (обычный или асинхронный итератор)
+        send: корутина отправки сообщения одному получателю
+        on_error: вызывается для каждой неудачной отправки
+        on_sent: вызывается для каждой успешной отправки
+        concurrency: количество параллельных отправителей
+        limiter: ограничитель скорости
+        kind: метка kind в метрике broadcast_messages_total (mailing - рассылка, approve - одобрение заявок)
+
+    Возвращает:
+        BroadcastResult: количество успешных и неудачных отправок, ошибки по типам
+    """
+    result = BroadcastResult()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def deliver(user_id: int) -> None:
+        error: Optional[Exception] = None
+        for _ in range(BROADCAST_MAX_RETRIES + 1):
+            await limiter.acquire()
+            try:
+                await send(user_id)
+            except TelegramRetryAfter as e:
+                limiter.pause(e.retry_after)
+                broadcast_messages.inc(kind=kind, result="retried")
+                error = e
+                continue
+            except Exception as e:
+                error = e
+                break
+            result.sent += 1
+            broadcast_messages.inc(kind=kind, result="sent")
+            if on_sent:
+                # Ошибка обработчика не должна останавливать отправителя: иначе рассылка зависнет
+                try:
+                    await on_sent(user_id)
+                except Exception:
+                    logger.exception("Ошибка обработчика успешной отправки")
+            return
+        error_type = classify_error(error)
+        result.failed += 1
+        result.errors[error_type] += 1
+        broadcast_messages.inc(kind=kind, result=f"failed_{error_type}")
+        if on_error:
+            try:
+                await on_error(user_id, error)
+            except Exception:
+                logger.exception("Ошибка обработчика неудачной отправки")
+
+    async def worker() -> None:
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            await deliver(user_id)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        async for user_id in _iterate(recipients):
+            await queue.put(user_id)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+    return result
@@ -0,0 +1,266 @@
+import asyncio
+import datetime
+import logging
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram import types
+from sqlalchemy import update, insert, select, func
+
+from config import WRITE_BUFFER_INTERVAL, WRITE_BUFFER_MAX_SIZE
+from db.models import Session, User, SubscriptionRequest, upsert_users
+from stats import add_channel_requests, add_daily
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Максимальное количество ID в одном условии IN (...)
+SQL_CHUNK_SIZE = 500
+
+
+def chunked(items: list, size: int = SQL_CHUNK_SIZE) -> List[list]:
+    """Разбивает список на части не длиннее size"""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class WriteBehindBuffer(ABC):
+    """
+    Базовый буфер отложенной записи.
+
+    Накапливает события в памяти и сохраняет их в БД одной транзакцией
+    каждые interval секунд или сразу после накопления max_size событий.
+    Наследники реализуют _take (забрать накопленное), _write (сохранить)
+    и _restore (вернуть пачку, которую не удалось сохранить, в буфер:
+    события из нее не теряются и сохраняются при следующей попытке).
+    Если указан after, перед сохранением сначала сохраняется этот буфер
+    (например, чтобы пользователь был создан до обновления его статуса).
+    """
+
+    def __init__(self, interval: float = WRITE_BUFFER_INTERVAL, max_size: int = WRITE_BUFFER_MAX_SIZE,
+                 after: Optional["WriteBehindBuffer"] = None) -> None:
+        self.interval = interval
+        self.max_size = max_size
+        self.after = after
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._lock = asyncio.Lock()
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Количество накопленных событий"""
+
+    @abstractmethod
+    def _take(self):
+        """Забирает накопленные события (буфер становится пустым)"""
+
+    @abstractmethod
+    async def _write(self, batch) -> None:
+        """Сохраняет пачку событий в БД"""
+
+    @abstractmethod
+    def _restore(self, batch) -> None:
+        """Возвращает в буфер пачку, которую не удалось сохранить"""
+
+    def _added(self) -> None:
+        """Вызывается наследником после добавления события"""
+        if len(self) >= self.max_size:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        """Запускает фоновое сохранение"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновое сохранение и сохраняет остаток"""
+        if self._task is not None:
+            # Задача не отменяется, а завершается сама: начатое сохранение доходит до конца
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        # Ошибка одного буфера не должна мешать остановке остальных
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception(f"Не удалось сохранить буфер {type(self).__name__} при остановке")
+
+    async def flush(self) -> None:
+        """Сохраняет накопленные события; при ошибке они остаются в буфере"""
+        async with self._lock:
+            if not len(self):
+                return
+            if self.after is not None:
+                await self.after.flush()
+            batch = self._take()
+            try:
+                await self._write(batch)
+            except BaseException:
+                # В том числе при отмене: иначе пачка пропадает
+                self._restore(batch)
+                raise
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                return
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception(f"Ошибка сохранения буфера {type(self).__name__}")
+
+
+class UserStatusBuffer(WriteBehindBuffer):
+    """
+    Буфер событий блокировки/разблокировки бота и прохождения проверки.
+
+    Повторные события одного пользователя схлопываются: сохраняется только
+    последнее состояние. При сохранении выполняется по одному UPDATE
+    на каждую пачку пользователей с одинаковым состоянием.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._blocked: Dict[int, bool] = {}
+        self._captcha: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._blocked) + len(self._captcha)
+
+    def set_blocked(self, user_id: int, is_blocked: bool) -> None:
+        """Запоминает новое состояние блокировки пользователя"""
+        self._blocked[user_id] = is_blocked
+        self._added()
+
+    def mark_captcha_passed(self, user_id: int) -> None:
+        """Запоминает, что пользователь нажал "Я человек!" """
+        self._captcha.add(user_id)
+        self._added()
+
+    def _take(self) -> Tuple[Dict[int, bool], Set[int]]:
+        batch = (self._blocked, self._captcha)
+        self._blocked, self._captcha = {}, set()
+        return batch
+
+    def _restore(self, batch: Tuple[Dict[int, bool], Set[int]]) -> None:
+        blocked, captcha = batch
+        # События, пришедшие после неудачной попытки, новее - они важнее
+        self._blocked = {**blocked, **self._blocked}
+        self._captcha |= captcha
+
+    async def _write(self, batch: Tuple[Dict[int, bool], Set[int]]) -> None:
+        blocked, captcha = batch
+        # Количество пользователей, у которых состояние действительно изменилось (для статистики)
+        changed = {True: 0, False: 0, "captcha": 0}
+        async with Session() as db:
+            for is_blocked in (True, False):
+                user_ids = [user_id for user_id, value in blocked.items() if value is is_blocked]
+                # При блокировке запоминается время первой блокировки, разблокировка его не сбрасывает
+                values = {"is_blocked": is_blocked}
+                if is_blocked:
+                    values["blocked_at"] = func.coalesce(User.blocked_at, datetime.datetime.now())
+                for chunk in chunked(user_ids):
+                    result = await db.execute(
+                        update(User)
+                        .where(User.id.in_(chunk), User.is_blocked != is_blocked)
+                        .values(**values)
+                        .execution_options(synchronize_session=False)
+                    )
+                    changed[is_blocked] += result.rowcount
+            # Сохраняется время первого прохождения проверки
+            for chunk in chunked(list(captcha)):
+                result = await db.execute(
+                    update(User)
+                    .where(User.id.in_(chunk), User.captcha_passed_at.is_(None))
+                    .values(captcha_passed_at=datetime.datetime.now())
+                    .execution_options(synchronize_session=False)
+                )
+                changed["captcha"] += result.rowcount
+            await add_daily(db, blocked=changed[True], unblocked=changed[False], captcha_passed=changed["captcha"])
+            await db.commit()
+
+
+class JoinRequestBuffer(WriteBehindBuffer):
+    """
+    Буфер запросов на вступление в канал.
+
+    Запросы сохраняются пачкой: один INSERT пользователей (с обновлением
+    профиля) и один многострочный INSERT в subscription_requests на каждые
+    SQL_CHUNK_SIZE запросов, все в одной транзакции.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._requests: List[dict] = []
+        # Канал последнего еще не сохраненного запроса каждого пользователя
+        self._last_channel: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def last_channel(self, user_id: int) -> Optional[int]:
+        """Возвращает канал последнего запроса пользователя, если он еще не сохранен в БД"""
+        return self._last_channel.get(user_id)
+
+    def add(self, user: types.User, chat: types.Chat) -> None:
+        """Запоминает запрос на вступление; время запроса фиксируется сразу"""
+        self._requests.append({
+            "user_id": user.id,
+            "username": user.username,
+            "first_name": user.first_name,
+            "last_name": user.last_name,
+            "channel_id": chat.id,
+            "channel_name": chat.title,
+            "time_request": datetime.datetime.now(),
+        })
+        self._last_channel[user.id] = chat.id
+        self._added()
+
+    def _take(self) -> List[dict]:
+        batch, self._requests = self._requests, []
+        self._last_channel = {}
+        return batch
+
+    def _restore(self, batch: List[dict]) -> None:
+        self._requests = batch + self._requests
+        for row in reversed(batch):
+            self._last_channel.setdefault(row["user_id"], row["channel_id"])
+
+    async def _write(self, batch: List[dict]) -> None:
+        # Последний профиль каждого пользователя из пачки
+        users = {
+            row["user_id"]: {
+                "id": row["user_id"],
+                "username": row["username"],
+                "first_name": row["first_name"],
+                "last_name": row["last_name"],
+            }
+            for row in batch
+        }
+        # Запросы по дням и каналам для статистики
+        requests = Counter((row["time_request"].date(), row["channel_id"]) for row in batch)
+        names = {row["channel_id"]: row["channel_name"] for row in batch}
+        async with Session() as db:
+            new_users = 0
+            for chunk in chunked(list(users.values())):
+                user_ids = [row["id"] for row in chunk]
+                existing = await db.scalar(select(func.count()).select_from(User).where(User.id.in_(user_ids)))
+                new_users += len(chunk) - existing
+                await db.execute(upsert_users(chunk))
+            for chunk in chunked(batch):
+                await db.execute(insert(SubscriptionRequest).values(chunk))
+            await add_channel_requests(db, requests, names)
+            await add_daily(db, new_users=new_users)
+            await db.commit()
+
+
+# Общие буферы приложения (запускаются в main.py)
+join_request_buffer = JoinRequestBuffer()
+user_status_buffer = UserStatusBuffer(after=join_request_buffer)
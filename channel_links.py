@@ -0,0 +1,92 @@
+from typing import Dict, Optional
+
+from sqlalchemy import select, delete
+
+from db.models import Session, ReadSession, Chanel, SubscriptionRequest, SubscriptionRequestArchive
+
+
+class ChannelLinkCache:
+    """
+    Кэш ссылок на каналы в памяти процесса.
+
+    Ссылка выбирается по каналу, в который пользователь подал запрос
+    (source_channel_id); ссылка с ключом None используется по умолчанию.
+    Ссылки загружаются из БД при запуске бота (load) и меняются только через
+    set/remove, которые сначала сохраняют изменение в БД, а затем обновляют
+    кэш. Чтение ссылки (get) к БД не обращается.
+    """
+
+    def __init__(self) -> None:
+        self._links: Dict[Optional[int], str] = {}
+
+    async def load(self) -> None:
+        """Загружает ссылки из БД, при необходимости создает ссылку по умолчанию"""
+        async with Session() as db:
+            result = await db.execute(select(Chanel).order_by(Chanel.id))
+            channels = result.scalars().all()
+            if not any(chanel.source_channel_id is None for chanel in channels):
+                chanel = Chanel()
+                db.add(chanel)
+                await db.commit()
+                channels.append(chanel)
+        self._links = {}
+        for chanel in channels:
+            self._links.setdefault(chanel.source_channel_id, chanel.link)
+
+    def get(self, source_channel_id: Optional[int] = None) -> Optional[str]:
+        """Возвращает ссылку для канала или ссылку по умолчанию (None, если кэш еще не загружен)"""
+        return self._links.get(source_channel_id) or self._links.get(None)
+
+    def get_all(self) -> Dict[Optional[int], str]:
+        """Возвращает все ссылки: канал -> ссылка (None - ссылка по умолчанию)"""
+        return dict(self._links)
+
+    def has_channel_links(self) -> bool:
+        """Заданы ли ссылки для отдельных каналов"""
+        return len(self._links) > 1 or None not in self._links
+
+    async def set(self, link: str, source_channel_id: Optional[int] = None) -> None:
+        """Сохраняет ссылку для канала (None - ссылку по умолчанию) в БД и обновляет кэш"""
+        async with Session() as db:
+            # Сравнение с None превращается в IS NULL
+            result = await db.execute(select(Chanel).where(Chanel.source_channel_id == source_channel_id))
+            chanel = result.scalars().first()
+
+            if chanel:
+                chanel.link = link
+            else:
+                chanel = Chanel(link=link, source_channel_id=source_channel_id)
+                db.add(chanel)
+
+            await db.commit()
+        self._links[source_channel_id] = link
+
+    async def remove(self, source_channel_id: int) -> None:
+        """Удаляет ссылку канала: его пользователи будут получать ссылку по умолчанию"""
+        async with Session() as db:
+            await db.execute(delete(Chanel).where(Chanel.source_channel_id == source_channel_id))
+            await db.commit()
+        self._links.pop(source_channel_id, None)
+
+
+async def last_request_channel(user_id: int) -> Optional[int]:
+    """
+    Возвращает канал последнего сохраненного запроса пользователя.
+
+    Поиск идет по индексу (user_id, time_request) и читает одну строку;
+    если в subscription_requests запросов нет, они ищутся в архиве.
+    """
+    async with ReadSession() as db:
+        for model in (SubscriptionRequest, SubscriptionRequestArchive):
+            channel_id = await db.scalar(
+                select(model.channel_id)
+                .where(model.user_id == user_id)
+                .order_by(model.time_request.desc())
+                .limit(1)
+            )
+            if channel_id is not None:
+                return channel_id
+    return None
+
+
+channel_link_cache = ChannelLinkCache()
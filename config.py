@@ -8,4 +8,102 @@ load_dotenv()
 TG_TOKEN: Optional[str] = os.environ.get("TG_TOKEN")
 ADMIN_IDS: List[int] = [int(x) for x in os.environ.get("ADMIN_IDS", "").split()]
 
+# Общая очередь исходящих сообщений: не больше OUTBOUND_RATE сообщений в секунду на бота
+# и не чаще одного сообщения в OUTBOUND_CHAT_INTERVAL секунд в один чат
+OUTBOUND_RATE: float = float(os.environ.get("OUTBOUND_RATE", "30"))
+OUTBOUND_CHAT_INTERVAL: float = float(os.environ.get("OUTBOUND_CHAT_INTERVAL", "1"))
+# Сколько раз очередь сама повторяет ответ или отложенное сообщение после 429 (рассылки повторяются в broadcast)
+OUTBOUND_MAX_RETRIES: int = int(os.environ.get("OUTBOUND_MAX_RETRIES", "3"))
 
+# Параметры рассылки: лимит Telegram ~30 сообщений в секунду на бота
+BROADCAST_RATE: float = float(os.environ.get("BROADCAST_RATE", "28"))
+BROADCAST_CONCURRENCY: int = int(os.environ.get("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_MAX_RETRIES: int = int(os.environ.get("BROADCAST_MAX_RETRIES", "3"))
+
+# Частота сохранения статусов доставки: каждые N получателей или каждые T секунд
+MAILING_CHECKPOINT_SIZE: int = int(os.environ.get("MAILING_CHECKPOINT_SIZE", "200"))
+MAILING_CHECKPOINT_INTERVAL: float = float(os.environ.get("MAILING_CHECKPOINT_INTERVAL", "2"))
+
+# Буферы отложенной записи в БД: сохранение каждые T секунд или после N событий
+WRITE_BUFFER_INTERVAL: float = float(os.environ.get("WRITE_BUFFER_INTERVAL", "0.3"))
+WRITE_BUFFER_MAX_SIZE: int = int(os.environ.get("WRITE_BUFFER_MAX_SIZE", "500"))
+
+# Задержка (в секундах) перед сообщением с благодарностью после нажатия "Я человек!"
+FOLLOW_UP_DELAY: float = float(os.environ.get("FOLLOW_UP_DELAY", "90"))
+# Ошибки для администраторов собираются и отправляются одним сообщением раз в N секунд
+ADMIN_ALERT_INTERVAL: float = float(os.environ.get("ADMIN_ALERT_INTERVAL", "10"))
+# Сколько отложенных сообщений может отправляться одновременно
+FOLLOW_UP_CONCURRENCY: int = int(os.environ.get("FOLLOW_UP_CONCURRENCY", "10"))
+
+# Режим получения обновлений: "polling" или "webhook"
+BOT_MODE: str = os.environ.get("BOT_MODE", "polling")
+# Удалять ли накопившиеся обновления при запуске (по умолчанию они обрабатываются)
+DROP_PENDING_UPDATES: bool = os.environ.get("DROP_PENDING_UPDATES", "0") == "1"
+
+# Параметры webhook: WEBHOOK_URL - внешний адрес сервера (например https://example.com),
+# если он пустой, webhook в Telegram не регистрируется (удобно для локальной проверки)
+WEBHOOK_URL: str = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_PATH: str = os.environ.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST: str = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT: int = int(os.environ.get("WEBHOOK_PORT", "8080"))
+# Секрет заголовка X-Telegram-Bot-Api-Secret-Token, обязателен: без него webhook не запускается
+WEBHOOK_SECRET: Optional[str] = os.environ.get("WEBHOOK_SECRET") or None
+# Сколько соединений Telegram может открыть одновременно (1-100)
+WEBHOOK_MAX_CONNECTIONS: int = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Сколько обновлений может обрабатываться одновременно
+WEBHOOK_MAX_CONCURRENT_UPDATES: int = int(os.environ.get("WEBHOOK_MAX_CONCURRENT_UPDATES", "100"))
+
+# Подключение к БД. DB_READ_URL - отдельный пул (или реплика) для долгих запросов
+# на чтение: выгрузки и выборки получателей рассылки
+DB_URL: str = os.environ.get("DB_URL", "sqlite+aiosqlite:///db/database.db")
+DB_READ_URL: str = os.environ.get("DB_READ_URL") or DB_URL
+DB_POOL_SIZE: int = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_READ_POOL_SIZE: int = int(os.environ.get("DB_READ_POOL_SIZE", "3"))
+
+# Настройки SQLite: размер кэша страниц (КБ), размер mmap (байт), ожидание блокировки (мс)
+SQLITE_CACHE_SIZE_KB: int = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE: int = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS: int = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Скорость и параллельность одобрения запросов на вступление
+APPROVE_RATE: float = float(os.environ.get("APPROVE_RATE", "20"))
+APPROVE_CONCURRENCY: int = int(os.environ.get("APPROVE_CONCURRENCY", "10"))
+
+# Окна (в секундах), в течение которых повторные события пользователя отбрасываются:
+# нажатия "Я человек!" и запросы на вступление в тот же канал
+THROTTLE_MESSAGE_WINDOW: float = float(os.environ.get("THROTTLE_MESSAGE_WINDOW", "5"))
+THROTTLE_JOIN_WINDOW: float = float(os.environ.get("THROTTLE_JOIN_WINDOW", "60"))
+
+# Адрес страницы метрик Prometheus (METRICS_PORT=0 отключает сервер метрик)
+METRICS_HOST: str = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT: int = int(os.environ.get("METRICS_PORT", "9101"))
+
+# Хранилище состояний FSM: db (таблица fsm_states в основной БД), redis или memory.
+# db и redis общие для нескольких процессов бота, memory - только для одного
+FSM_STORAGE: str = os.environ.get("FSM_STORAGE", "db")
+FSM_REDIS_URL: str = os.environ.get("FSM_REDIS_URL", "redis://localhost:6379/0")
+# Через сколько секунд без изменений состояние удаляется и как часто проверять
+FSM_TTL: int = int(os.environ.get("FSM_TTL", "86400"))
+FSM_CLEANUP_INTERVAL: float = float(os.environ.get("FSM_CLEANUP_INTERVAL", "3600"))
+# Сколько секунд db помнит, что у пользователя (не администратора) нет состояния, и не спрашивает БД
+FSM_ABSENT_CACHE_TTL: float = float(os.environ.get("FSM_ABSENT_CACHE_TTL", "60"))
+
+# Хранение запросов на подписку: строки старше RETENTION_DAYS дней переносятся в архив
+# (0 - не переносить). Перенос идет пачками по RETENTION_BATCH_SIZE строк каждые
+# RETENTION_INTERVAL секунд, после него освобождается не больше RETENTION_VACUUM_PAGES
+# страниц файла БД за шаг. Выбор получателей рассылки и ссылки по каналу читают и архив,
+# а выгрузка и одобрение заявок - только subscription_requests
+RETENTION_DAYS: int = int(os.environ.get("RETENTION_DAYS", "0"))
+RETENTION_BATCH_SIZE: int = int(os.environ.get("RETENTION_BATCH_SIZE", "5000"))
+RETENTION_INTERVAL: float = float(os.environ.get("RETENTION_INTERVAL", "3600"))
+RETENTION_VACUUM_PAGES: int = int(os.environ.get("RETENTION_VACUUM_PAGES", "2000"))
+
+# HTTP-сессия Bot API: число соединений, время жизни кэша DNS и простаивающего
+# соединения, таймаут запроса (секунды). По умолчанию соединений не меньше, чем у aiogram
+# (100), и не меньше, чем одновременных запросов рассылки, одобрения заявок, отложенных
+# сообщений с запасом на ответы пользователям; соединения открываются только по мере надобности
+BOT_API_CONNECTIONS: int = int(os.environ.get("BOT_API_CONNECTIONS", "0")) \
+    or max(100, BROADCAST_CONCURRENCY + APPROVE_CONCURRENCY + FOLLOW_UP_CONCURRENCY + 20)
+BOT_API_DNS_TTL: int = int(os.environ.get("BOT_API_DNS_TTL", "300"))
+BOT_API_KEEPALIVE: float = float(os.environ.get("BOT_API_KEEPALIVE", "60"))
+BOT_API_TIMEOUT: float = float(os.environ.get("BOT_API_TIMEOUT", "30"))
@@ -1,13 +1,64 @@
 import datetime
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, BigInteger, ForeignKey, Text
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncAttrs
+from sqlalchemy import Column, Integer, String, Date, DateTime, Boolean, BigInteger, ForeignKey, Text, Index, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncAttrs, AsyncEngine
 from sqlalchemy.orm import DeclarativeBase, relationship
 
-# Настройка асинхронного подключения к SQLite3
-DB_URL = "sqlite+aiosqlite:///db/database.db"
-engine = create_async_engine(DB_URL)  # Асинхронный движок SQLAlchemy
-Session = async_sessionmaker(expire_on_commit=False, bind=engine)  # Фабрика сессий
+from config import (DB_URL, DB_READ_URL, DB_POOL_SIZE, DB_READ_POOL_SIZE, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE,
+                    SQLITE_BUSY_TIMEOUT_MS)
+
+
+def _set_sqlite_pragmas(dbapi_connection, read_only: bool) -> None:
+    """Настраивает новое соединение SQLite"""
+    cursor = dbapi_connection.cursor()
+    if not read_only:
+        # Действует только для новой (пустой) БД: освобожденные страницы можно вернуть
+        # системе через PRAGMA incremental_vacuum (см. retention.py)
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL: чтение не блокирует запись, а запись - чтение
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # В режиме WAL NORMAL безопасен при сбое процесса и не делает fsync на каждый commit
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+def make_engine(url: str, pool_size: int, read_only: bool = False) -> AsyncEngine:
+    """
+    Создает асинхронный движок SQLAlchemy.
+
+    Для SQLite каждое новое соединение настраивается PRAGMA (WAL, synchronous,
+    кэш, mmap, busy_timeout); соединения движка только для чтения дополнительно
+    получают query_only. Для других СУБД используется обычный пул соединений.
+    """
+    engine = create_async_engine(url, pool_size=pool_size)
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine.sync_engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            _set_sqlite_pragmas(dbapi_connection, read_only)
+    return engine
+
+
+# Движок и фабрика сессий для обработчиков (запись и короткие запросы)
+engine = make_engine(DB_URL, DB_POOL_SIZE)
+Session = async_sessionmaker(expire_on_commit=False, bind=engine)
+
+# Отдельный пул для долгих запросов на чтение, чтобы они не занимали соединения записи
+read_engine = make_engine(DB_READ_URL, DB_READ_POOL_SIZE, read_only=True)
+ReadSession = async_sessionmaker(expire_on_commit=False, bind=read_engine)
+
+
+def dialect_insert(model):
+    """Возвращает INSERT с поддержкой ON CONFLICT для текущей СУБД (SQLite или PostgreSQL)"""
+    if engine.dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
 
 
 class Base(DeclarativeBase, AsyncAttrs):
@@ -21,6 +72,32 @@ class Chanel(Base):
 
     id = Column(Integer, primary_key=True)  # ID канала
     link = Column(String, default="https://telegram.org/")  # Ссылка на канал
+    # Канал, запрос в который ведет на эту ссылку (NULL - ссылка по умолчанию)
+    source_channel_id = Column(BigInteger)
+
+    __table_args__ = (
+        Index("ix_channel_source_channel_id", "source_channel_id", unique=True),
+    )
+
+
+class User(Base):
+    """Модель пользователя Telegram (одна запись на пользователя)"""
+    __tablename__ = "users"
+
+    # ID пользователя Telegram; в SQLite INTEGER PRIMARY KEY совпадает с rowid
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=False)
+    username = Column(String)  # @username пользователя
+    first_name = Column(String)  # Имя пользователя
+    last_name = Column(String)  # Фамилия пользователя
+    is_blocked = Column(Boolean, default=False, nullable=False)  # Пользователь заблокировал бота
+    captcha_passed_at = Column(DateTime)  # Время нажатия "Я человек!"
+    blocked_at = Column(DateTime)  # Время первой блокировки бота (NULL - ни разу не блокировал)
+    created_at = Column(DateTime, default=datetime.datetime.now)  # Время первого запроса
+
+    __table_args__ = (
+        # Выборка получателей рассылки: WHERE is_blocked = 0
+        Index("ix_users_is_blocked", "is_blocked", "id"),
+    )
 
 
 class SubscriptionRequest(Base):
@@ -35,10 +112,251 @@ class SubscriptionRequest(Base):
     channel_id = Column(BigInteger, nullable=False)  # ID канала
     channel_name = Column(String)  # Название канала
     time_request = Column(DateTime, default=datetime.datetime.now)  # Время запроса
-    user_is_block = Column(Boolean, default=False)  # Флаг блокировки пользователя
+    user_is_block = Column(Boolean, default=False)  # Устарело: флаг блокировки хранится в User.is_blocked
+    approve_status = Column(String)  # Результат одобрения: NULL - ожидает, approved / missing / failed
+
+    __table_args__ = (
+        # Запросы пользователя по времени
+        Index("ix_subscription_requests_user_time", "user_id", "time_request"),
+        # Запросы в канал по времени
+        Index("ix_subscription_requests_channel_time", "channel_id", "time_request"),
+        # Выборка по периоду
+        Index("ix_subscription_requests_time", "time_request"),
+        # Ожидающие одобрения запросы в канал
+        Index("ix_subscription_requests_channel_approve", "channel_id", "approve_status", "user_id"),
+    )
+
+
+class SubscriptionRequestArchive(Base):
+    """
+    Архив старых запросов на подписку (см. retention.py).
+
+    Профиль пользователя и название канала не хранятся: они есть в users
+    и channel_daily_stats. Индексы нужны выбору получателей рассылки по
+    каналу и выбору ссылки по последнему запросу пользователя.
+    """
+    __tablename__ = "subscription_requests_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)  # ID исходной строки
+    user_id = Column(BigInteger, nullable=False)  # ID пользователя Telegram
+    channel_id = Column(BigInteger, nullable=False)  # ID канала
+    time_request = Column(DateTime)  # Время запроса
+    approve_status = Column(String)  # Результат одобрения
+
+    __table_args__ = (
+        Index("ix_subscription_requests_archive_channel_time", "channel_id", "time_request"),
+        Index("ix_subscription_requests_archive_user_time", "user_id", "time_request"),
+    )
+
+
+class ScheduledMessage(Base):
+    """Модель отложенного сообщения пользователю (одно на пользователя и шаблон)"""
+    __tablename__ = "scheduled_messages"
+
+    chat_id = Column(BigInteger, primary_key=True)  # ID получателя
+    template = Column(String, primary_key=True)  # Ключ текста сообщения
+    send_at = Column(DateTime, nullable=False)  # Время отправки
+
+
+class MailingJob(Base):
+    """Модель задания рассылки"""
+    __tablename__ = "mailing_jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    payload = Column(Text, nullable=False)  # JSON с содержимым сообщения
+    audience = Column(Text)  # JSON с условиями выбора получателей (NULL - все незаблокированные)
+    admin_id = Column(BigInteger)  # ID администратора, запустившего рассылку
+    status = Column(String, default="running", nullable=False)  # preparing / running / finished / cancelled / failed
+    created_at = Column(DateTime, default=datetime.datetime.now)  # Время создания
+    finished_at = Column(DateTime)  # Время завершения
+
+
+class MailingDelivery(Base):
+    """Модель статуса доставки рассылки одному получателю"""
+    __tablename__ = "mailing_deliveries"
+
+    job_id = Column(Integer, ForeignKey("mailing_jobs.id"), primary_key=True)  # ID рассылки
+    user_id = Column(BigInteger, primary_key=True)  # ID получателя
+    status = Column(String, default="pending", nullable=False)  # pending / sent / failed / blocked
+    error = Column(String)  # Тип ошибки для неудачной отправки (см. broadcast.classify_error)
+
+    __table_args__ = (
+        Index("ix_mailing_deliveries_job_status", "job_id", "status", "user_id"),
+    )
+
+
+class ChannelDailyStats(Base):
+    """Сводка запросов на вступление по каналам и дням (обновляется при сохранении запросов)"""
+    __tablename__ = "channel_daily_stats"
+
+    day = Column(Date, primary_key=True)  # День запроса
+    channel_id = Column(BigInteger, primary_key=True)  # ID канала
+    channel_name = Column(String)  # Последнее известное название канала
+    requests = Column(Integer, default=0, nullable=False)  # Количество запросов
+
+
+class DailyStats(Base):
+    """Сводка событий пользователей по дням (обновляется при сохранении событий)"""
+    __tablename__ = "daily_stats"
+
+    day = Column(Date, primary_key=True)  # День
+    new_users = Column(Integer, default=0, nullable=False)  # Новые пользователи
+    captcha_passed = Column(Integer, default=0, nullable=False)  # Впервые нажали "Я человек!"
+    blocked = Column(Integer, default=0, nullable=False)  # Заблокировали бота
+    unblocked = Column(Integer, default=0, nullable=False)  # Разблокировали бота
+
+
+class FSMRecord(Base):
+    """Модель состояния FSM (мастер рассылки и т.п.) для одного ключа чат/пользователь"""
+    __tablename__ = "fsm_states"
+
+    key = Column(String, primary_key=True)  # Ключ aiogram (см. DefaultKeyBuilder)
+    state = Column(String)  # Текущее состояние
+    data = Column(Text)  # JSON с данными состояния
+    updated_at = Column(DateTime, nullable=False, default=datetime.datetime.now)  # Время последнего изменения
+
+    __table_args__ = (
+        # Удаление устаревших записей
+        Index("ix_fsm_states_updated_at", "updated_at"),
+    )
+
+
+def upsert_users(rows: list):
+    """
+    Возвращает INSERT пользователей, который у существующих записей
+    обновляет только профиль (флаг блокировки не меняется)
+    """
+    stmt = dialect_insert(User).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[User.id],
+        set_={
+            "username": stmt.excluded.username,
+            "first_name": stmt.excluded.first_name,
+            "last_name": stmt.excluded.last_name,
+        }
+    )
+
+
+def _create_indexes(conn, model, *names: str) -> None:
+    """
+    Создает перечисленные индексы модели, если их еще нет.
+
+    Индексы перечисляются по имени, а не все индексы модели: миграция
+    создает только те, чьи столбцы существуют на ее версии схемы.
+    """
+    indexes = {index.name: index for index in model.__table__.indexes}
+    for name in names:
+        indexes[name].create(conn, checkfirst=True)
+
+
+def _migration_1_users(conn) -> None:
+    """Создает индексы subscription_requests и заполняет таблицу users"""
+    _create_indexes(conn, SubscriptionRequest, "ix_subscription_requests_user_time",
+                    "ix_subscription_requests_channel_time", "ix_subscription_requests_time")
+    # Профиль берется из последнего запроса пользователя, флаг блокировки -
+    # из любого запроса, помеченного заблокированным
+    conn.exec_driver_sql("""
+        INSERT OR IGNORE INTO users (id, username, first_name, last_name, is_blocked, created_at)
+        SELECT s.user_id, s.username, s.first_name, s.last_name,
+               COALESCE((SELECT MAX(user_is_block) FROM subscription_requests WHERE user_id = s.user_id), 0),
+               (SELECT MIN(time_request) FROM subscription_requests WHERE user_id = s.user_id)
+        FROM subscription_requests s
+        WHERE s.id = (SELECT MAX(id) FROM subscription_requests WHERE user_id = s.user_id)
+    """)
+
+
+def _add_column(conn, table: str, column: str, ddl: str) -> None:
+    """Добавляет столбец в таблицу, если его еще нет"""
+    columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def _migration_2_delivery_error(conn) -> None:
+    """Добавляет тип ошибки в статусы доставки рассылок"""
+    _add_column(conn, "mailing_deliveries", "error", "VARCHAR")
+
+
+def _migration_3_approvals(conn) -> None:
+    """Добавляет статус одобрения запросов и отметку о прохождении проверки"""
+    _add_column(conn, "subscription_requests", "approve_status", "VARCHAR")
+    _add_column(conn, "users", "captcha_passed_at", "DATETIME")
+    _create_indexes(conn, SubscriptionRequest, "ix_subscription_requests_channel_approve")
+
+
+def _migration_4_stats(conn) -> None:
+    """Заполняет сводные таблицы статистики по уже сохраненным данным"""
+    conn.exec_driver_sql("""
+        INSERT INTO channel_daily_stats (day, channel_id, channel_name, requests)
+        SELECT date(time_request), channel_id, MAX(channel_name), COUNT(*)
+        FROM subscription_requests
+        WHERE time_request IS NOT NULL
+        GROUP BY date(time_request), channel_id
+    """)
+    # Дата блокировки не сохранялась, поэтому уже заблокировавшие учитываются в день регистрации
+    conn.exec_driver_sql("""
+        INSERT INTO daily_stats (day, new_users, captcha_passed, blocked, unblocked)
+        SELECT day, SUM(new_users), SUM(captcha_passed), SUM(blocked), 0
+        FROM (
+            SELECT date(created_at) AS day, 1 AS new_users, 0 AS captcha_passed, is_blocked AS blocked
+            FROM users WHERE created_at IS NOT NULL
+            UNION ALL
+            SELECT date(captcha_passed_at), 0, 1, 0 FROM users WHERE captcha_passed_at IS NOT NULL
+        )
+        GROUP BY day
+    """)
+
+
+def _migration_5_audience(conn) -> None:
+    """Добавляет условия выбора получателей в задания рассылки"""
+    _add_column(conn, "mailing_jobs", "audience", "TEXT")
+
+
+def _migration_6_channel_source(conn) -> None:
+    """Добавляет привязку ссылки к каналу, из которого пришел запрос"""
+    _add_column(conn, "channel", "source_channel_id", "BIGINT")
+    _create_indexes(conn, Chanel, "ix_channel_source_channel_id")
+
+
+def _migration_7_archive_indexes(conn) -> None:
+    """Добавляет индексы архива запросов для выбора получателей и ссылок"""
+    _create_indexes(conn, SubscriptionRequestArchive, "ix_subscription_requests_archive_channel_time",
+                    "ix_subscription_requests_archive_user_time")
+
+
+def _migration_8_blocked_at(conn) -> None:
+    """Добавляет время первой блокировки бота пользователем"""
+    _add_column(conn, "users", "blocked_at", "DATETIME")
+    # Дата блокировки не сохранялась, поэтому у уже заблокировавших берется день регистрации
+    conn.exec_driver_sql("UPDATE users SET blocked_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE is_blocked = 1")
+
+
+# Миграции схемы по порядку; номер текущей версии хранится в PRAGMA user_version
+MIGRATIONS = [
+    _migration_1_users,
+    _migration_2_delivery_error,
+    _migration_3_approvals,
+    _migration_4_stats,
+    _migration_5_audience,
+    _migration_6_channel_source,
+    _migration_7_archive_indexes,
+    _migration_8_blocked_at,
+]
+
+
+def _migrate(conn) -> None:
+    """Применяет к существующей БД SQLite миграции, которые еще не были применены"""
+    # Другие СУБД подключаются к новой БД, и create_all создает актуальную схему
+    if conn.dialect.name != "sqlite":
+        return
+    version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(conn)
+        conn.exec_driver_sql(f"PRAGMA user_version = {number}")
 
 
 async def create_tables():
-    """Создает таблицы в базе данных"""
+    """Создает таблицы в базе данных и применяет миграции"""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_migrate)
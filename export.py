@@ -0,0 +1,135 @@
+import asyncio
+import csv
+import gzip
+import os
+import tempfile
+from typing import AsyncIterator, List, Optional
+
+from openpyxl import Workbook
+from sqlalchemy import select
+
+from db.models import ReadSession, SubscriptionRequest, User
+
+# Количество строк, читаемых из БД за один запрос
+EXPORT_CHUNK_SIZE = 5000
+
+EXPORT_HEADERS = ["ID", "User ID", "Username", "First Name", "Last Name", "Channel ID", "Channel Name",
+                  "Time Request", "User Is Block"]
+
+
+def _format_row(row: tuple) -> list:
+    """Приводит строку выгрузки к виду для файла"""
+    row = list(row)
+    time_request = row[7]
+    row[7] = time_request.strftime("%Y-%m-%d %H:%M:%S") if time_request else None
+    row[8] = bool(row[8])
+    return row
+
+
+class XlsxWriter:
+    """Запись выгрузки в Excel в режиме write_only (строки не держатся в памяти)"""
+    extension = "xlsx"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet("Subscription Requests")
+        self.ws.append(EXPORT_HEADERS)
+
+    def write(self, rows: List[tuple]) -> None:
+        for row in rows:
+            self.ws.append(_format_row(row))
+
+    def close(self) -> None:
+        self.wb.save(self.path)
+
+
+class CsvGzWriter:
+    """Запись выгрузки в сжатый CSV"""
+    extension = "csv.gz"
+
+    def __init__(self, path: str) -> None:
+        self.file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        self.csv = csv.writer(self.file)
+        self.csv.writerow(EXPORT_HEADERS)
+
+    def write(self, rows: List[tuple]) -> None:
+        self.csv.writerows(_format_row(row) for row in rows)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+WRITERS = {
+    "xlsx": XlsxWriter,
+    "csv": CsvGzWriter,
+}
+
+
+async def iter_export_rows(chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[List[tuple]]:
+    """
+    Выдает строки subscription_requests (с флагом блокировки из users)
+    порциями по chunk_size.
+
+    Запросы идут через отдельный пул чтения; каждая порция читается коротким
+    запросом по первичному ключу, поэтому выгрузка не держит открытую
+    транзакцию чтения все время работы.
+    """
+    last_id = 0
+    while True:
+        async with ReadSession() as db:
+            result = await db.execute(
+                select(
+                    SubscriptionRequest.id,
+                    SubscriptionRequest.user_id,
+                    SubscriptionRequest.username,
+                    SubscriptionRequest.first_name,
+                    SubscriptionRequest.last_name,
+                    SubscriptionRequest.channel_id,
+                    SubscriptionRequest.channel_name,
+                    SubscriptionRequest.time_request,
+                    User.is_blocked,
+                )
+                .outerjoin(User, User.id == SubscriptionRequest.user_id)
+                .where(SubscriptionRequest.id > last_id)
+                .order_by(SubscriptionRequest.id)
+                .limit(chunk_size)
+            )
+            rows = result.all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+async def export_subscriptions(fmt: str = "xlsx") -> str:
+    """
+    Выгружает запросы на подписку во временный файл.
+
+    Чтение из БД идет порциями в цикле событий, а форматирование и запись
+    файла - в отдельном потоке, параллельно чтению следующей порции.
+    Файл удаляет вызывающий код.
+
+    Параметры:
+        fmt: "xlsx" или "csv" (сжатый csv.gz)
+
+    Возвращает:
+        str: путь к файлу выгрузки
+    """
+    writer_class = WRITERS[fmt]
+    fd, path = tempfile.mkstemp(suffix="." + writer_class.extension)
+    os.close(fd)
+    try:
+        writer = await asyncio.to_thread(writer_class, path)
+        pending: Optional[asyncio.Future] = None
+        async for rows in iter_export_rows():
+            if pending:
+                await pending
+            pending = asyncio.ensure_future(asyncio.to_thread(writer.write, rows))
+        if pending:
+            await pending
+        await asyncio.to_thread(writer.close)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
@@ -0,0 +1,148 @@
+import asyncio
+import datetime
+import json
+import logging
+import time
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import select, delete
+
+from config import ADMIN_IDS, FSM_STORAGE, FSM_REDIS_URL, FSM_TTL, FSM_CLEANUP_INTERVAL, FSM_ABSENT_CACHE_TTL
+from db.models import Session, ReadSession, FSMRecord, dialect_insert
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class DatabaseStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в таблице fsm_states основной БД.
+
+    Состояния хранятся только в БД, поэтому их видят все процессы бота,
+    работающие с одной БД, и они переживают перезапуск. FSMContextMiddleware
+    запрашивает состояние на каждое обновление, а состояния в боте бывают
+    только у администраторов (мастер рассылки), поэтому для администраторов
+    (ADMIN_IDS) состояние всегда читается из БД, а для остальных ответ
+    "состояния нет" запоминается в процессе на absent_ttl секунд: повторные
+    обновления пользователя к БД не обращаются. Изменение состояния в этом
+    процессе сбрасывает запомненный ответ сразу, в другом процессе - не позже
+    чем через absent_ttl секунд. Строки без состояния и данных удаляются
+    сразу, а не изменявшиеся дольше ttl секунд - фоновой очисткой (start/close).
+    """
+
+    def __init__(self, ttl: int = FSM_TTL, cleanup_interval: float = FSM_CLEANUP_INTERVAL,
+                 absent_ttl: float = FSM_ABSENT_CACHE_TTL, key_builder: Optional[KeyBuilder] = None) -> None:
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self.absent_ttl = absent_ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True, with_business_connection_id=True)
+        self._task: Optional[asyncio.Task] = None
+        # Ключи, для которых в БД нет строки -> до какого момента (monotonic) этому верить
+        self._absent: Dict[str, float] = {}
+        self._next_prune = 0.0
+
+    def _cacheable(self, key: StorageKey) -> bool:
+        return bool(self.absent_ttl) and key.user_id not in ADMIN_IDS
+
+    async def _get(self, key: StorageKey) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        """Возвращает (состояние, данные в JSON) ключа или None, если строки нет"""
+        record_key = self.key_builder.build(key)
+        cacheable = self._cacheable(key)
+        now = time.monotonic()
+        if cacheable and self._absent.get(record_key, 0.0) > now:
+            return None
+        async with ReadSession() as db:
+            row = (await db.execute(
+                select(FSMRecord.state, FSMRecord.data).where(FSMRecord.key == record_key)
+            )).first()
+        if row is None and cacheable:
+            if now >= self._next_prune:
+                self._absent = {k: until for k, until in self._absent.items() if until > now}
+                self._next_prune = now + 60
+            self._absent[record_key] = now + self.absent_ttl
+        return tuple(row) if row is not None else None
+
+    async def _set(self, key: StorageKey, **values: Any) -> None:
+        """Сохраняет переданные поля строки (state и/или data)"""
+        record_key = self.key_builder.build(key)
+        values["updated_at"] = datetime.datetime.now()
+        stmt = dialect_insert(FSMRecord).values(key=record_key, **values)
+        async with Session() as db:
+            await db.execute(stmt.on_conflict_do_update(index_elements=[FSMRecord.key], set_=values))
+            await db.execute(
+                delete(FSMRecord)
+                .where(FSMRecord.key == record_key, FSMRecord.state.is_(None), FSMRecord.data.is_(None))
+            )
+            await db.commit()
+        self._absent.pop(record_key, None)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._set(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._get(key)
+        return record[0] if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._set(key, data=json.dumps(dict(data), ensure_ascii=False) if data else None)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._get(key)
+        return json.loads(record[1]) if record and record[1] else {}
+
+    async def cleanup(self) -> int:
+        """Удаляет состояния, не изменявшиеся дольше ttl секунд. Возвращает количество удаленных"""
+        expired = datetime.datetime.now() - datetime.timedelta(seconds=self.ttl)
+        async with Session() as db:
+            result = await db.execute(delete(FSMRecord).where(FSMRecord.updated_at < expired))
+            await db.commit()
+        return result.rowcount
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                removed = await self.cleanup()
+                if removed:
+                    logger.info(f"Удалено устаревших состояний FSM: {removed}")
+            except Exception:
+                logger.exception("Ошибка очистки состояний FSM")
+            await asyncio.sleep(self.cleanup_interval)
+
+    def start(self) -> None:
+        """Запускает фоновую очистку устаревших состояний"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def create_fsm_storage() -> BaseStorage:
+    """
+    Создает хранилище состояний FSM по настройке FSM_STORAGE.
+
+    redis требует установленного пакета redis; TTL задается самому Redis.
+    memory хранит состояния в памяти процесса (теряются при перезапуске).
+    """
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    if FSM_STORAGE == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(
+            FSM_REDIS_URL,
+            key_builder=DefaultKeyBuilder(with_destiny=True, with_business_connection_id=True),
+            state_ttl=FSM_TTL,
+            data_ttl=FSM_TTL,
+        )
+    storage = DatabaseStorage()
+    storage.start()
+    return storage
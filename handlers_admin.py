@@ -1,23 +1,30 @@
 # handlers_admin.py
-import io
+import os
 
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup, default_state
-from openpyxl import Workbook
 from aiogram import types, F, Router
 from aiogram.filters import Command, StateFilter
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from sqlalchemy import select
 
-from bot import bot
+from approvals import approve_requests, list_pending_channels, claim_channel, running_channels
+from channel_links import channel_link_cache
 from config import ADMIN_IDS
-from db.models import Session, Chanel, SubscriptionRequest
+from export import export_subscriptions, WRITERS
 from keyboard import create_kb, kb_button
+from mailing import create_job, start_job, cancel_job, Audience, MailingPayload, run_in_background
+from stats import stats_report, list_channels
 
 router = Router()
 
 class FSMFillForm(StatesGroup):
+    link_channel = State()
     link = State()
+    audience_channel = State()
+    audience_days = State()
+    audience_captcha = State()
+    audience_never_blocked = State()
     send = State()
     text_add_button = State()
     check_text_1 = State()
@@ -35,32 +42,40 @@ class FSMFillForm(StatesGroup):
     video_add_button_text = State()
     video_add_button_url = State()
     check_video_note_1 = State()
+    check_copy = State()
 
 
 def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_IDS
 
 
-async def get_all_users_unblock():
-    async with Session() as session:
-        query = select(SubscriptionRequest).where(SubscriptionRequest.user_is_block == False)
-        users = await session.execute(query)
-        result = []
-        for user in users.scalars():
-            if user not in result:
-                result.append(user.user_id)
-    return result
-
-
 def admin_menu_keyboard():
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Выполнить рассылку", callback_data="admin_mailing")],
         [InlineKeyboardButton(text="Выгрузить юзеров", callback_data="admin_export_users")],
-        [InlineKeyboardButton(text="Заменить ссылку", callback_data="admin_change_link")]
+        [InlineKeyboardButton(text="Выгрузить юзеров (CSV)", callback_data="admin_export_users_csv")],
+        [InlineKeyboardButton(text="Заменить ссылку", callback_data="admin_change_link")],
+        [InlineKeyboardButton(text="Одобрить заявки", callback_data="admin_approve")],
+        [InlineKeyboardButton(text="Статистика", callback_data="admin_stats")]
     ])
     return keyboard
 
 
+async def start_mailing(cb: types.CallbackQuery, state: FSMContext) -> None:
+    """Сохраняет рассылку как задание в БД и запускает ее в фоне"""
+    dct = await state.get_data()
+    # Сбрасываем состояние сразу, чтобы повторное нажатие не запустило рассылку дважды
+    await state.set_state(default_state)
+    await state.clear()
+    job_id = await create_job(MailingPayload.from_data(dct), cb.from_user.id, Audience.from_data(dct.get("audience")))
+
+    async def on_done(report: str) -> None:
+        await cb.message.answer(text=report, reply_markup=admin_menu_keyboard())
+
+    # Ход рассылки показывается в отдельном сообщении, обработчик сразу завершается
+    start_job(job_id, cb.message.chat.id, on_done)
+
+
 @router.message(Command("start"), F.from_user.id.in_(ADMIN_IDS))
 async def admin_start(message: types.Message):
     if not is_admin(message.from_user.id):
@@ -68,49 +83,36 @@ async def admin_start(message: types.Message):
     await message.answer("Добро пожаловать в меню администратора!", reply_markup=admin_menu_keyboard())
 
 
-@router.callback_query(F.data == "admin_export_users")
+@router.callback_query(F.data.in_({"admin_export_users", "admin_export_users_csv"}))
 async def admin_export_users(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.id):
         return
 
-    async with Session() as db:
-        result = await db.execute(select(SubscriptionRequest))
-        requests = result.scalars().all()
-
-    # Создаем Excel файл
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Subscription Requests"
-
-    # Заголовки
-    headers = ["ID", "User ID", "Username", "First Name", "Last Name", "Channel ID", "Channel Name", "Time Request",
-               "User Is Block"]
-    ws.append(headers)
-
-    # Данные
-    for req in requests:
-        ws.append([
-            req.id,
-            req.user_id,
-            req.username,
-            req.first_name,
-            req.last_name,
-            req.channel_id,
-            req.channel_name,
-            req.time_request.strftime("%Y-%m-%d %H:%M:%S") if req.time_request else None,
-            req.user_is_block
-        ])
+    # Файл собирается в отдельном потоке и не блокирует остальных пользователей
+    fmt = "csv" if callback.data == "admin_export_users_csv" else "xlsx"
+    path = await export_subscriptions(fmt)
+    try:
+        await callback.message.answer_document(
+            types.FSInputFile(path, filename=f"subscription_requests.{WRITERS[fmt].extension}"),
+            caption="Выгрузка данных о подписках"
+        )
+    finally:
+        os.remove(path)
+    await callback.message.answer("Добро пожаловать в меню администратора!", reply_markup=admin_menu_keyboard())
 
-    # Сохраняем в байтовый поток
-    file_stream = io.BytesIO()
-    wb.save(file_stream)
-    file_stream.seek(0)
 
-    await callback.message.answer_document(
-        types.BufferedInputFile(file_stream.read(), filename="subscription_requests.xlsx"),
-        caption="Выгрузка данных о подписках"
+@router.callback_query(F.data == "admin_stats")
+async def admin_stats(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        return
+
+    # Статистика читается из сводных таблиц, без подсчета по subscription_requests
+    await callback.message.edit_text(
+        await stats_report(),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="↩️ Назад", callback_data="admin_back")]
+        ])
     )
-    await callback.message.answer("Добро пожаловать в меню администратора!", reply_markup=admin_menu_keyboard())
 
 
 @router.callback_query(F.data == "admin_change_link")
@@ -118,13 +120,32 @@ async def admin_change_link(callback: types.CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         return
 
-    async with Session() as db:
-        result = await db.execute(select(Chanel))
-        chanel = result.scalar_one_or_none()
-        current_link = chanel.link if chanel else "не установлена"
+    # Ссылка по умолчанию и отдельные ссылки для каналов, в которые подавались заявки
+    links = channel_link_cache.get_all()
+    lines = [f"По умолчанию: {links.get(None) or 'не установлена'}"]
+    buttons = [[InlineKeyboardButton(text="Ссылка по умолчанию", callback_data="link_ch:0")]]
+    for channel_id, name in await list_channels():
+        lines.append(f"{name}: {links.get(channel_id) or 'по умолчанию'}")
+        buttons.append([InlineKeyboardButton(text=name, callback_data=f"link_ch:{channel_id}")])
+    buttons.append([InlineKeyboardButton(text="↩️ Назад", callback_data="admin_back")])
+
+    await callback.message.edit_text(
+        "Текущие ссылки:\n" + "\n".join(lines) + "\n\nДля какого канала заменить ссылку?",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
+    await state.set_state(FSMFillForm.link_channel)
+
 
+@router.callback_query(F.data.startswith("link_ch:"), StateFilter(FSMFillForm.link_channel), F.from_user.id.in_(ADMIN_IDS))
+async def admin_choose_link_channel(callback: types.CallbackQuery, state: FSMContext):
+    channel_id = int(callback.data.split(":")[1]) or None
+    await state.update_data(link_channel_id=channel_id)
+
+    text = f"Сейчас ссылка - {channel_link_cache.get(channel_id) or 'не установлена'}. Введите новую ссылку!"
+    if channel_id is not None:
+        text += "\nОтправьте «-», чтобы этот канал использовал ссылку по умолчанию"
     await callback.message.edit_text(
-        f"Сейчас ваша ссылка - {current_link}. Введите новую ссылку!",
+        text,
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="↩️ Назад", callback_data="admin_back")]
         ])
@@ -137,19 +158,16 @@ async def admin_get_new_link(message: types.Message, state: FSMContext):
     if not is_admin(message.from_user.id):
         return
 
+    channel_id = (await state.get_data()).get("link_channel_id")
+    if message.text == "-" and channel_id is not None:
+        await channel_link_cache.remove(channel_id)
+        await message.answer("Канал будет использовать ссылку по умолчанию", reply_markup=admin_menu_keyboard())
+        await state.set_state(default_state)
+        await state.clear()
     # Проверяем, что сообщение похоже на ссылку
-    if message.text.startswith(('http://', 'https://', 't.me/')):
-        async with Session() as db:
-            result = await db.execute(select(Chanel))
-            chanel = result.scalar_one_or_none()
-
-            if chanel:
-                chanel.link = message.text
-            else:
-                chanel = Chanel(link=message.text)
-                db.add(chanel)
-
-            await db.commit()
+    elif message.text.startswith(('http://', 'https://', 't.me/')):
+        # Сохраняем ссылку в БД и сразу обновляем кэш
+        await channel_link_cache.set(message.text, channel_id)
 
         await message.answer("Ссылка изменена!", reply_markup=admin_menu_keyboard())
         await state.set_state(default_state)
@@ -158,6 +176,94 @@ async def admin_get_new_link(message: types.Message, state: FSMContext):
         await message.answer("Пожалуйста, введите корректную ссылку (начинается с http://, https:// или t.me/)")
 
 
+@router.callback_query(F.data == "admin_approve")
+async def admin_approve(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        return
+
+    channels = await list_pending_channels()
+    if not channels:
+        await callback.message.edit_text("Нет заявок, ожидающих одобрения", reply_markup=admin_menu_keyboard())
+        return
+
+    buttons = [
+        [InlineKeyboardButton(text=f"{title or channel_id} ({count})", callback_data=f"approve_ch:{channel_id}")]
+        for channel_id, title, count in channels
+    ]
+    buttons.append([InlineKeyboardButton(text="↩️ Назад", callback_data="admin_back")])
+    await callback.message.edit_text(
+        "Выберите канал, заявки в который нужно одобрить",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
+
+
+@router.callback_query(F.data.startswith("approve_ch:"))
+async def admin_approve_channel(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        return
+
+    channel_id = callback.data.split(":")[1]
+    await callback.message.edit_text(
+        "Кого одобрить?",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Всех", callback_data=f"approve_run:{channel_id}:all")],
+            [InlineKeyboardButton(text="Только нажавших «Я человек!»", callback_data=f"approve_run:{channel_id}:captcha")],
+            [InlineKeyboardButton(text="↩️ Назад", callback_data="admin_back")]
+        ])
+    )
+
+
+@router.callback_query(F.data.startswith("approve_run:"))
+async def admin_approve_run(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        return
+
+    _, channel_id, mode = callback.data.split(":")
+    channel_id = int(channel_id)
+    # Канал отмечается до первого await, чтобы повторное нажатие не запустило одобрение дважды
+    if not claim_channel(channel_id):
+        await callback.answer("Одобрение заявок в этот канал уже идет", show_alert=True)
+        return
+
+    try:
+        message = await callback.message.edit_text("Одобрение заявок запущено...")
+    except Exception:
+        running_channels.discard(channel_id)
+        raise
+
+    async def progress(approved: int, failed: int, total: int) -> None:
+        try:
+            await message.edit_text(f"Одобрение заявок: одобрено {approved} из {total}, ошибок {failed}")
+        except TelegramBadRequest:
+            pass
+
+    async def run() -> None:
+        try:
+            approved, failed = await approve_requests(channel_id, mode == "captcha", progress, claimed=True)
+        except Exception as e:
+            await message.answer(f"Одобрение заявок прервано из-за ошибки: {e}", reply_markup=admin_menu_keyboard())
+            raise
+        await message.answer(
+            f"Одобрение заявок завершено: одобрено {approved}, ошибок {failed}",
+            reply_markup=admin_menu_keyboard()
+        )
+
+    # Одобрение идет в фоне, обработчик сразу завершается
+    run_in_background(run())
+
+
+@router.callback_query(F.data.startswith("mailing_stop:"))
+async def admin_mailing_stop(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        return
+
+    job_id = int(callback.data.split(":")[1])
+    if cancel_job(job_id):
+        await callback.answer("Рассылка останавливается...")
+    else:
+        await callback.answer("Рассылка уже завершена", show_alert=True)
+
+
 @router.callback_query(F.data == "admin_back")
 async def admin_back(callback: types.CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
@@ -167,10 +273,76 @@ async def admin_back(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text("Добро пожаловать в меню администратора!", reply_markup=admin_menu_keyboard())
 
 
+#Выбор получателей рассылки
+
+
 @router.callback_query(F.data == "admin_mailing", StateFilter(default_state), F.from_user.id.in_(ADMIN_IDS))
-async def send_to_all(callback: types.Message, state: FSMContext):
-    await callback.message.answer(text='Сейчас мы подготовим сообщение для рассылки по юзерам!\n'
-                              'Отправьте пжл текстовое сообщение или картинку(можно с текстом) или видео(можно с текстом) или видео-кружок')
+async def audience_channel(callback: types.CallbackQuery, state: FSMContext):
+    buttons = [[InlineKeyboardButton(text="Всем пользователям", callback_data="aud_ch:0")]]
+    buttons.extend(
+        [InlineKeyboardButton(text=f"Подавшим заявку в {name}", callback_data=f"aud_ch:{channel_id}")]
+        for channel_id, name in await list_channels()
+    )
+    buttons.append([InlineKeyboardButton(text="↩️ Назад", callback_data="admin_back")])
+    await callback.message.answer(text='Кому отправить рассылку?',
+                                  reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+    await state.set_state(FSMFillForm.audience_channel)
+
+
+@router.callback_query(F.data.startswith("aud_ch:"), StateFilter(FSMFillForm.audience_channel), F.from_user.id.in_(ADMIN_IDS))
+async def audience_days(cb: types.CallbackQuery, state: FSMContext):
+    await state.update_data(audience={"channel_id": int(cb.data.split(":")[1])})
+    await cb.message.edit_text(
+        text='За какой период учитывать заявки?',
+        reply_markup=create_kb(2, aud_days_0='За все время', aud_days_1='За сутки',
+                               aud_days_7='За 7 дней', aud_days_30='За 30 дней')
+    )
+    await state.set_state(FSMFillForm.audience_days)
+
+
+@router.callback_query(F.data.startswith("aud_days_"), StateFilter(FSMFillForm.audience_days), F.from_user.id.in_(ADMIN_IDS))
+async def audience_captcha(cb: types.CallbackQuery, state: FSMContext):
+    audience = (await state.get_data())["audience"]
+    audience["days"] = int(cb.data.rsplit("_", 1)[1])
+    await state.update_data(audience=audience)
+    await cb.message.edit_text(
+        text='Отправить только нажавшим «Я человек!»?',
+        reply_markup=create_kb(2, aud_captcha_1='Да', aud_captcha_0='Нет, всем')
+    )
+    await state.set_state(FSMFillForm.audience_captcha)
+
+
+@router.callback_query(F.data.startswith("aud_captcha_"), StateFilter(FSMFillForm.audience_captcha), F.from_user.id.in_(ADMIN_IDS))
+async def audience_never_blocked(cb: types.CallbackQuery, state: FSMContext):
+    audience = (await state.get_data())["audience"]
+    audience["only_captcha"] = cb.data.endswith("_1")
+    await state.update_data(audience=audience)
+    await cb.message.edit_text(
+        text='Исключить тех, кто когда-либо блокировал бота?',
+        reply_markup=create_kb(2, aud_nb_1='Да', aud_nb_0='Нет')
+    )
+    await state.set_state(FSMFillForm.audience_never_blocked)
+
+
+@router.callback_query(F.data.startswith("aud_nb_"), StateFilter(FSMFillForm.audience_never_blocked), F.from_user.id.in_(ADMIN_IDS))
+async def audience_preview(cb: types.CallbackQuery, state: FSMContext):
+    audience = (await state.get_data())["audience"]
+    audience["never_blocked"] = cb.data.endswith("_1")
+    await state.update_data(audience=audience)
+
+    # Предварительный подсчет получателей тем же запросом, которым они будут выбраны
+    count = await Audience.from_data(audience).count()
+    if not count:
+        await cb.message.edit_text(text='Под выбранные условия не подходит ни один пользователь',
+                                   reply_markup=admin_menu_keyboard())
+        await state.set_state(default_state)
+        await state.clear()
+        return
+
+    await cb.message.edit_text(text=f'Получателей: {count}')
+    await cb.message.answer(text='Сейчас мы подготовим сообщение для рассылки по юзерам!\n'
+                              'Отправьте пжл текстовое сообщение или картинку(можно с текстом) или видео(можно с текстом) или видео-кружок.\n'
+                              'Любое другое сообщение (документ, голосовое, опрос и т.д.) будет разослано как есть')
     await state.set_state(FSMFillForm.send)
 
 
@@ -195,19 +367,7 @@ async def text_add_button_no(cb: types.CallbackQuery, state: FSMContext):
 
 @router.callback_query(F.data == 'yes', StateFilter(FSMFillForm.check_text_1), F.from_user.id.in_(ADMIN_IDS))
 async def check_text_yes_1(cb: types.CallbackQuery, state: FSMContext):
-    dct = await state.get_data()
-    users = await get_all_users_unblock()
-    count = 0
-    for user_id in users:
-        try:
-            await bot.send_message(user_id, text=dct['text'])
-            count += 1
-        except Exception as e:
-            await bot.send_message(1012882762, str(e))
-            await bot.send_message(1012882762, str(user_id))
-    await cb.message.answer(text=f'Сообщение отправлено {count} юзерам', reply_markup=admin_menu_keyboard())
-    await state.set_state(default_state)
-    await state.clear()
+    await start_mailing(cb, state)
 
 
 @router.callback_query(F.data == 'yes', StateFilter(FSMFillForm.text_add_button), F.from_user.id.in_(ADMIN_IDS))
@@ -239,19 +399,7 @@ async def text_add_button_yes_3(message: types.Message, state: FSMContext):
 
 @router.callback_query(F.data == 'yes', StateFilter(FSMFillForm.check_text_2), F.from_user.id.in_(ADMIN_IDS))
 async def check_text_yes_2(cb: types.CallbackQuery, state: FSMContext):
-    dct = await state.get_data()
-    users = await get_all_users_unblock()
-    count = 0
-    for user_id in users:
-        try:
-            await bot.send_message(user_id, text=dct['text'], reply_markup=kb_button(dct['button_text'], dct['button_url']))
-            count += 1
-        except Exception as e:
-            await bot.send_message(1012882762, str(e))
-            await bot.send_message(1012882762, str(user_id))
-    await cb.message.answer(text=f'Сообщение отправлено {count} юзерам', reply_markup=admin_menu_keyboard())
-    await state.set_state(default_state)
-    await state.clear()
+    await start_mailing(cb, state)
 
 
 @router.callback_query(F.data == 'no', StateFilter(FSMFillForm.check_text_1, FSMFillForm.check_text_2), F.from_user.id.in_(ADMIN_IDS))
@@ -289,22 +437,7 @@ async def text_add_button_no(cb: types.CallbackQuery, state: FSMContext):
 
 @router.callback_query(F.data == 'yes', StateFilter(FSMFillForm.check_photo_1), F.from_user.id.in_(ADMIN_IDS))
 async def check_photo_yes_1(cb: types.CallbackQuery, state: FSMContext):
-    dct = await state.get_data()
-    users = await get_all_users_unblock()
-    count = 0
-    for user_id in users:
-        try:
-            if dct.get('caption'):
-                await bot.send_photo(user_id, photo=dct['photo_id'], caption=dct['caption'])
-            else:
-                await bot.send_photo(user_id, photo=dct['photo_id'])
-            count += 1
-        except Exception as e:
-            await bot.send_message(1012882762, str(e))
-            await bot.send_message(1012882762, str(user_id))
-    await cb.message.answer(text=f'Сообщение отправлено {count} юзерам', reply_markup=admin_menu_keyboard())
-    await state.set_state(default_state)
-    await state.clear()
+    await start_mailing(cb, state)
 
 
 @router.callback_query(F.data == 'yes', StateFilter(FSMFillForm.photo_add_button), F.from_user.id.in_(ADMIN_IDS))
@@ -340,22 +473,7 @@ async def photo_add_button_yes_3(message: types.Message, state: FSMContext):
 
 @router.callback_query(F.data == 'yes', StateFilter(FSMFillForm.check_photo_2), F.from_user.id.in_(ADMIN_IDS))
 async def check_photo_yes_2(cb: types.CallbackQuery, state: FSMContext):
-    dct = await state.get_data()
-    users = await get_all_users_unblock()
-    count = 0
-    for user_id in users:
-        try:
-            if dct.get('caption'):
-                    await bot.send_photo(user_id, photo=dct['photo_id'], caption=dct['caption'], reply_markup=kb_button(dct['button_text'], dct['button_url']))
-            else:
-                await bot.send_photo(user_id, photo=dct['photo_id'], reply_markup=kb_button(dct['button_text'], dct['button_url']))
-            count += 1
-        except Exception as e:
-            await bot.send_message(1012882762, str(e))
-            await bot.send_message(1012882762, str(user_id))
-    await cb.message.answer(text=f'Сообщение отправлено {count} юзерам', reply_markup=admin_menu_keyboard())
-    await state.set_state(default_state)
-    await state.clear()
+    await start_mailing(cb, state)
 
 
 @router.callback_query(F.data == 'no', StateFilter(FSMFillForm.check_text_1, FSMFillForm.check_text_2,
@@ -394,22 +512,7 @@ async def video_add_button_no(cb: types.CallbackQuery, state: FSMContext):
 
 @router.callback_query(F.data == 'yes', StateFilter(FSMFillForm.check_video_1), F.from_user.id.in_(ADMIN_IDS))
 async def check_video_yes_1(cb: types.CallbackQuery, state: FSMContext):
-    dct = await state.get_data()
-    users = await get_all_users_unblock()
-    count = 0
-    for user_id in users:
-        try:
-            if dct.get('caption'):
-                await bot.send_video(user_id, video=dct['video_id'], caption=dct['caption'])
-            else:
-                await bot.send_video(user_id, video=dct['video_id'])
-            count += 1
-        except Exception as e:
-            await bot.send_message(1012882762, str(e))
-            await bot.send_message(1012882762, str(user_id))
-    await cb.message.answer(text=f'Сообщение отправлено {count} юзерам', reply_markup=admin_menu_keyboard())
-    await state.set_state(default_state)
-    await state.clear()
+    await start_mailing(cb, state)
 
 
 @router.callback_query(F.data == 'yes', StateFilter(FSMFillForm.video_add_button), F.from_user.id.in_(ADMIN_IDS))
@@ -445,22 +548,7 @@ async def video_add_button_yes_3(message: types.Message, state: FSMContext):
 
 @router.callback_query(F.data == 'yes', StateFilter(FSMFillForm.check_video_2), F.from_user.id.in_(ADMIN_IDS))
 async def check_video_yes_2(cb: types.CallbackQuery, state: FSMContext):
-    dct = await state.get_data()
-    users = await get_all_users_unblock()
-    count = 0
-    for user_id in users:
-        try:
-            if dct.get('caption'):
-                await bot.send_video(user_id, video=dct['video_id'], caption=dct['caption'], reply_markup=kb_button(dct['button_text'], dct['button_url']))
-            else:
-                await bot.send_video(user_id, video=dct['video_id'], reply_markup=kb_button(dct['button_text'], dct['button_url']))
-            count += 1
-        except Exception as e:
-            await bot.send_message(1012882762, str(e))
-            await bot.send_message(1012882762, str(user_id))
-    await cb.message.answer(text=f'Сообщение отправлено {count} юзерам', reply_markup=admin_menu_keyboard())
-    await state.set_state(default_state)
-    await state.clear()
+    await start_mailing(cb, state)
 
 
 #Создание видео-кружка
@@ -476,19 +564,24 @@ async def video_note_check(message: types.Message, state: FSMContext):
 
 @router.callback_query(F.data == 'yes', StateFilter(FSMFillForm.check_video_note_1), F.from_user.id.in_(ADMIN_IDS))
 async def check_video_note_yes_1(cb: types.CallbackQuery, state: FSMContext):
-    dct = await state.get_data()
-    users = await get_all_users_unblock()
-    count = 0
-    for user_id in users:
-        try:
-            await bot.send_video_note(user_id, video_note=dct['video_note_id'])
-            count += 1
-        except Exception as e:
-            await bot.send_message(1012882762, str(e))
-            await bot.send_message(1012882762, str(user_id))
-    await cb.message.answer(text=f'Сообщение отправлено {count} юзерам', reply_markup=admin_menu_keyboard())
-    await state.set_state(default_state)
-    await state.clear()
+    await start_mailing(cb, state)
+
+
+#Рассылка копии любого другого сообщения (документ, голосовое, опрос и т.д.)
+
+
+@router.message(StateFilter(FSMFillForm.send), F.from_user.id.in_(ADMIN_IDS))
+async def copy_message_check(message: types.Message, state: FSMContext):
+    await state.update_data(from_chat_id=message.chat.id, message_id=message.message_id)
+    await message.answer(text='Проверьте ваше сообщение для отправки')
+    await message.copy_to(message.chat.id)
+    await message.answer(text='Отправляем?', reply_markup=create_kb(2, yes='Да', no='Нет'))
+    await state.set_state(FSMFillForm.check_copy)
+
+
+@router.callback_query(F.data == 'yes', StateFilter(FSMFillForm.check_copy), F.from_user.id.in_(ADMIN_IDS))
+async def check_copy_yes(cb: types.CallbackQuery, state: FSMContext):
+    await start_mailing(cb, state)
 
 
 # Выход из рассылки без отправки
@@ -496,7 +589,8 @@ async def check_video_note_yes_1(cb: types.CallbackQuery, state: FSMContext):
 
 @router.callback_query(F.data == 'no', StateFilter(FSMFillForm.check_text_1, FSMFillForm.check_text_2,
                        FSMFillForm.check_photo_1, FSMFillForm.check_photo_2, FSMFillForm.check_video_1,
-                       FSMFillForm.check_video_2, FSMFillForm.check_video_note_1), F.from_user.id.in_(ADMIN_IDS))
+                       FSMFillForm.check_video_2, FSMFillForm.check_video_note_1, FSMFillForm.check_copy),
+                       F.from_user.id.in_(ADMIN_IDS))
 async def check_message_no(cb: types.CallbackQuery, state: FSMContext):
     await cb.message.answer(text=f'Сообщение не отправлено', reply_markup=admin_menu_keyboard())
     await state.set_state(default_state)
@@ -1,18 +1,25 @@
-import asyncio
-
 from aiogram import types, F, Router
 from aiogram.filters import ChatMemberUpdatedFilter, KICKED, MEMBER
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ChatMemberUpdated, InlineKeyboardMarkup, \
     InlineKeyboardButton
-from sqlalchemy import select
 
+from admin_alerts import admin_alerts
 from bot import bot
-from config import ADMIN_IDS
-from db.models import SubscriptionRequest, Session, Chanel
+from buffers import user_status_buffer, join_request_buffer
+from channel_links import channel_link_cache, last_request_channel
+from config import FOLLOW_UP_DELAY, THROTTLE_MESSAGE_WINDOW, THROTTLE_JOIN_WINDOW
+from middlewares import ThrottlingMiddleware
+from scheduler import follow_up_scheduler
 
 # Инициализация роутера для обработки пользовательских событий
 router = Router()
 
+# Отбрасывание повторных событий от одного пользователя
+message_throttling = ThrottlingMiddleware(THROTTLE_MESSAGE_WINDOW, "message")
+join_request_throttling = ThrottlingMiddleware(THROTTLE_JOIN_WINDOW, "chat_join_request")
+router.message.outer_middleware(message_throttling)
+router.chat_join_request.outer_middleware(join_request_throttling)
+
 
 @router.chat_join_request()
 async def handle_join_request(join_request: types.ChatJoinRequest) -> None:
@@ -21,7 +28,7 @@ async def handle_join_request(join_request: types.ChatJoinRequest) -> None:
 
     Эта функция:
     1. Извлекает информацию о пользователе и канале
-    2. Сохраняет запрос на подписку в базу данных
+    2. Передает пользователя и запрос на подписку в буфер записи в БД
     3. Отправляет пользователю кнопку для подтверждения
     4. Автоматически удаляет сообщение через 60 секунд
 
@@ -35,19 +42,8 @@ async def handle_join_request(join_request: types.ChatJoinRequest) -> None:
     user = join_request.from_user
     chat = join_request.chat
 
-    async with Session() as db:
-        # Создаем новый объект запроса на подписку
-        request = SubscriptionRequest(
-            user_id=user.id,
-            username=user.username,
-            first_name=user.first_name,
-            last_name=user.last_name,
-            channel_id=chat.id,
-            channel_name=chat.title
-        )
-        # Добавляем запрос в сессию и сохраняем в БД
-        db.add(request)
-        await db.commit()
+    # Запрос сохраняется в БД пачкой вместе с другими, ответ пользователю не ждет записи
+    join_request_buffer.add(user, chat)
 
     # Создаем клавиатуру с кнопкой подтверждения
     keyboard = ReplyKeyboardMarkup(
@@ -67,58 +63,46 @@ async def handle_join_request(join_request: types.ChatJoinRequest) -> None:
 @router.message(F.text == "👤 Я человек!")
 async def handle_step_1(message: types.Message):
     """Обрабатывает нажатие кнопки 'Я человек!'"""
-
-    async with Session() as db:
-        # Находим запрос в базе данных
-        result = await db.execute(
-            select(Chanel))
-        chanel = result.scalar_one_or_none()
-        if not chanel:
-            request = Chanel()
-            # Добавляем запрос в сессию и сохраняем в БД
-            db.add(request)
-            await db.commit()
-        result = await db.execute(
-            select(Chanel))
-        chanel = result.scalar_one_or_none()
-        try:
-            # Создаем кнопку для подписки на канал
-            subscribe_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="📢 Подписаться", url=chanel.link)]
-            ])
-
-            # Отправляем сообщение с просьбой подписаться
-            await bot.send_message(
-                chat_id=message.from_user.id,
-                text="📢 Пожалуйста, подпишитесь на этот канал!",
-                reply_markup=subscribe_keyboard
-            )
-
-        except Exception as e:
-            print(e)
-            for admin_id in ADMIN_IDS:
-                try:
-                    await bot.send_message(
-                        admin_id,
-                        f"❌ Ошибка при нажатии на кнопку Я человек - {e}"
-                    )
-                except Exception as e:
-                    pass
-
-        # Ждем 60 секунд и отправляем сообщение с благодарностью
-        await asyncio.sleep(90)
+    # Отмечаем прохождение проверки (сохраняется в БД пачкой)
+    user_status_buffer.mark_captcha_passed(message.from_user.id)
+
+    try:
+        # Ссылка зависит от канала, в который пользователь подал запрос; сам запрос может
+        # быть еще в буфере, иначе канал ищется по индексу. Ссылки берутся из кэша
+        source_channel_id = None
+        if channel_link_cache.has_channel_links():
+            source_channel_id = (join_request_buffer.last_channel(message.from_user.id)
+                                 or await last_request_channel(message.from_user.id))
+
+        # Создаем кнопку для подписки на канал
+        subscribe_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="📢 Подписаться", url=channel_link_cache.get(source_channel_id))]
+        ])
+
+        # Отправляем сообщение с просьбой подписаться
         await bot.send_message(
             chat_id=message.from_user.id,
-            text="🙏 Спасибо за вашу заявку на подписку! Модераторы рассмотрят её в ближайшее время! ⏰"
+            text="📢 Пожалуйста, подпишитесь на этот канал!",
+            reply_markup=subscribe_keyboard
         )
 
+    except Exception as e:
+        print(e)
+        # Уведомление отправляется в фоне, обработчик его не ждет
+        admin_alerts.add(f"❌ Ошибка при нажатии на кнопку Я человек - {e}")
+
+    # Планируем сообщение с благодарностью, обработчик при этом сразу завершается
+    follow_up_scheduler.schedule(message.from_user.id, "thanks", FOLLOW_UP_DELAY)
+
 
 @router.my_chat_member(ChatMemberUpdatedFilter(member_status_changed=KICKED))
 async def user_blocked_bot(event: ChatMemberUpdated) -> None:
     """
     Обрабатывает событие блокировки бота пользователем.
 
-    Помечает пользователя как заблокированного в базе данных.
+    Помечает пользователя как заблокированного в базе данных. Событие попадает
+    в буфер user_status_buffer и сохраняется вместе с другими событиями
+    одним UPDATE; повторные события пользователя схлопываются.
 
     Параметры:
         event (ChatMemberUpdated): Событие изменения статуса чата
@@ -126,19 +110,7 @@ async def user_blocked_bot(event: ChatMemberUpdated) -> None:
     Возвращает:
         None
     """
-    async with Session() as db:
-        # Поиск всех записей для указанного пользователя
-        result = await db.execute(
-            select(SubscriptionRequest).filter(
-                SubscriptionRequest.user_id == event.from_user.id,
-            )
-        )
-        requests = result.scalars().all()
-
-        # Обновление статуса блокировки для всех записей
-        for request in requests:
-            request.user_is_block = True
-        await db.commit()
+    user_status_buffer.set_blocked(event.from_user.id, True)
 
 
 @router.my_chat_member(ChatMemberUpdatedFilter(member_status_changed=MEMBER))
@@ -146,7 +118,9 @@ async def user_unblocked_bot(event: ChatMemberUpdated) -> None:
     """
     Обрабатывает событие разблокировки бота пользователем.
 
-    Помечает пользователя как активного в базе данных.
+    Помечает пользователя как активного в базе данных. Событие попадает
+    в буфер user_status_buffer и сохраняется вместе с другими событиями
+    одним UPDATE; повторные события пользователя схлопываются.
 
     Параметры:
         event (ChatMemberUpdated): Событие изменения статуса чата
@@ -154,16 +128,4 @@ async def user_unblocked_bot(event: ChatMemberUpdated) -> None:
     Возвращает:
         None
     """
-    async with Session() as db:
-        # Поиск всех записей для указанного пользователя
-        result = await db.execute(
-            select(SubscriptionRequest).filter(
-                SubscriptionRequest.user_id == event.from_user.id,
-            )
-        )
-        requests = result.scalars().all()
-
-        # Обновление статуса блокировки для всех записей
-        for request in requests:
-            request.user_is_block = False
-        await db.commit()
\ No newline at end of file
+    user_status_buffer.set_blocked(event.from_user.id, False)
\ No newline at end of file
@@ -31,3 +31,9 @@ def kb_button(button_text, button_url):
     button = InlineKeyboardButton(text=button_text, url=button_url)
     kb = InlineKeyboardMarkup(inline_keyboard=[[button]])
     return kb
+
+
+def stop_keyboard(job_id: int) -> InlineKeyboardMarkup:
+    """Кнопка остановки рассылки под сообщением о ее ходе"""
+    button = InlineKeyboardButton(text="⛔ Остановить", callback_data=f"mailing_stop:{job_id}")
+    return InlineKeyboardMarkup(inline_keyboard=[[button]])
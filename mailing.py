@@ -0,0 +1,563 @@
+import asyncio
+import datetime
+import json
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, fields, asdict
+from typing import AsyncIterator, Awaitable, Callable, Coroutine, Dict, List, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import TelegramMethod, SendMessage, SendPhoto, SendVideo, SendVideoNote, CopyMessage
+from sqlalchemy import select, update, func, or_
+
+from bot import bot
+from broadcast import (broadcast, classify_error, SendFunc, ERROR_BLOCKED, ERROR_NOT_FOUND, ERROR_RETRY_AFTER,
+                       ERROR_OTHER)
+from config import ADMIN_IDS, MAILING_CHECKPOINT_SIZE, MAILING_CHECKPOINT_INTERVAL
+from db.models import (Session, ReadSession, User, SubscriptionRequest, SubscriptionRequestArchive, MailingJob,
+                       MailingDelivery, dialect_insert)
+from keyboard import kb_button, stop_keyboard
+from outbound import outbound_priority, PRIORITY_BULK
+from stats import add_daily
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Статусы доставки получателю
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+# Названия типов ошибок для отчета
+ERROR_TITLES = {
+    ERROR_BLOCKED: "заблокировали бота",
+    ERROR_NOT_FOUND: "чат не найден",
+    ERROR_RETRY_AFTER: "превышен лимит Telegram",
+    ERROR_OTHER: "другие ошибки",
+}
+
+# Как часто обновлять сообщение о ходе рассылки (секунды)
+PROGRESS_INTERVAL = 3
+
+# Вызывается с количеством отправленных, неудачных и общим количеством получателей
+ProgressFunc = Callable[[int, int, int], Awaitable[None]]
+
+# Ссылки на фоновые задачи, чтобы их не удалил сборщик мусора
+_tasks: Set[asyncio.Task] = set()
+
+# Выполняющиеся рассылки: ID задания -> задача
+running_jobs: Dict[int, asyncio.Task] = {}
+
+# Рассылки, которые остановил администратор
+_cancel_requested: Set[int] = set()
+
+
+def _log_task_error(task: asyncio.Task) -> None:
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Ошибка фоновой задачи", exc_info=task.exception())
+
+
+def run_in_background(coro: Coroutine) -> asyncio.Task:
+    """Запускает корутину фоновой задачей; необработанная ошибка задачи попадает в лог"""
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_log_task_error)
+    return task
+
+
+@dataclass(frozen=True)
+class Audience:
+    """
+    Условия выбора получателей рассылки.
+
+    Без условий получатели - все незаблокированные пользователи. channel_id
+    и days отбирают тех, кто подавал запрос в канал (в любой, если channel_id
+    не задан) за последние days дней; only_captcha - только нажавших "Я человек!";
+    never_blocked - исключает и тех, кто блокировал бота, а потом разблокировал.
+    """
+    channel_id: Optional[int] = None
+    days: Optional[int] = None
+    only_captcha: bool = False
+    never_blocked: bool = False
+
+    @classmethod
+    def from_data(cls, data: Optional[dict]) -> "Audience":
+        """Создает условия из данных FSM или сохраненного задания"""
+        data = data or {}
+        return cls(**{field.name: data[field.name] for field in fields(cls) if data.get(field.name)})
+
+    def to_json(self) -> Optional[str]:
+        """Сериализует условия для хранения в mailing_jobs.audience (None - без условий)"""
+        data = {key: value for key, value in asdict(self).items() if value}
+        return json.dumps(data) if data else None
+
+    def query(self):
+        """
+        Собирает один запрос ID получателей.
+
+        Отбор по запросам идет через индекс (channel_id, time_request) или
+        (time_request) и учитывает запросы, перенесенные в архив (retention.py),
+        остальные условия - по users.
+        """
+        query = select(User.id).where(User.is_blocked == False)
+        if self.channel_id or self.days:
+            query = query.where(or_(*(
+                User.id.in_(self._requests(model)) for model in (SubscriptionRequest, SubscriptionRequestArchive)
+            )))
+        if self.only_captcha:
+            query = query.where(User.captcha_passed_at.is_not(None))
+        if self.never_blocked:
+            query = query.where(User.blocked_at.is_(None))
+        return query
+
+    def _requests(self, model):
+        """ID пользователей, подававших подходящие запросы, из таблицы запросов или архива"""
+        requests = select(model.user_id)
+        if self.channel_id:
+            requests = requests.where(model.channel_id == self.channel_id)
+        if self.days:
+            since = datetime.datetime.now() - datetime.timedelta(days=self.days)
+            requests = requests.where(model.time_request >= since)
+        return requests
+
+    async def count(self) -> int:
+        """Возвращает количество получателей"""
+        async with ReadSession() as db:
+            return await db.scalar(select(func.count()).select_from(self.query().subquery()))
+
+
+async def iter_recipients(audience: Audience = Audience(), chunk_size: int = 1000) -> AsyncIterator[List[int]]:
+    """
+    Выдает ID получателей, подходящих под условия audience, порциями по chunk_size.
+
+    Каждый пользователь хранится в users один раз, поэтому повторов нет.
+    Строки читаются курсором из пула чтения по мере обработки, так что
+    весь список в памяти не собирается.
+    """
+    query = audience.query().execution_options(yield_per=chunk_size)
+    async with ReadSession() as db:
+        result = await db.stream_scalars(query)
+        async for user_ids in result.partitions():
+            yield user_ids
+
+
+@dataclass(frozen=True)
+class MailingPayload:
+    """
+    Содержимое рассылки любого типа.
+
+    Тип определяется заполненными полями: text, photo_id, video_id,
+    video_note_id или from_chat_id + message_id (копия любого сообщения
+    через copy_message). Кнопка-ссылка задается button_text и button_url.
+    """
+    text: Optional[str] = None
+    photo_id: Optional[str] = None
+    video_id: Optional[str] = None
+    video_note_id: Optional[str] = None
+    caption: Optional[str] = None
+    button_text: Optional[str] = None
+    button_url: Optional[str] = None
+    from_chat_id: Optional[int] = None
+    message_id: Optional[int] = None
+
+    @classmethod
+    def from_data(cls, data: dict) -> "MailingPayload":
+        """Создает содержимое рассылки из данных FSM или сохраненного задания"""
+        return cls(**{field.name: data[field.name] for field in fields(cls) if data.get(field.name)})
+
+    def to_json(self) -> str:
+        """Сериализует содержимое для хранения в mailing_jobs.payload"""
+        return json.dumps({key: value for key, value in asdict(self).items() if value is not None},
+                          ensure_ascii=False)
+
+    def render(self) -> TelegramMethod:
+        """Собирает запрос к Bot API без получателя (chat_id подставляет sender)"""
+        markup = kb_button(self.button_text, self.button_url) if self.button_url else None
+        if self.message_id:
+            return CopyMessage(chat_id=0, from_chat_id=self.from_chat_id, message_id=self.message_id,
+                               reply_markup=markup)
+        if self.photo_id:
+            return SendPhoto(chat_id=0, photo=self.photo_id, caption=self.caption, reply_markup=markup)
+        if self.video_id:
+            return SendVideo(chat_id=0, video=self.video_id, caption=self.caption, reply_markup=markup)
+        if self.video_note_id:
+            return SendVideoNote(chat_id=0, video_note=self.video_note_id)
+        return SendMessage(chat_id=0, text=self.text, reply_markup=markup)
+
+    def sender(self) -> SendFunc:
+        """
+        Возвращает функцию отправки рассылки одному получателю.
+
+        Запрос с клавиатурой собирается и проверяется один раз; для каждого
+        получателя делается только поверхностная копия с другим chat_id.
+        """
+        method = self.render()
+        return lambda user_id: bot(method.model_copy(update={"chat_id": user_id}))
+
+
+class DeliveryLedger:
+    """
+    Буфер статусов доставки одной рассылки.
+
+    Статусы накапливаются в памяти и сохраняются в БД пачками: каждые
+    MAILING_CHECKPOINT_SIZE получателей или MAILING_CHECKPOINT_INTERVAL секунд.
+    При перезапуске повторно отправляются только получатели из последней
+    несохраненной пачки.
+    """
+
+    def __init__(self, job_id: int) -> None:
+        self.job_id = job_id
+        self._batch: Dict[Tuple[str, Optional[str]], List[int]] = {}
+        self._size = 0
+        self._flushed_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def record(self, user_id: int, status: str, error: Optional[str] = None) -> None:
+        """Запоминает статус доставки получателю (и тип ошибки, если она была)"""
+        self._batch.setdefault((status, error), []).append(user_id)
+        self._size += 1
+        if (self._size >= MAILING_CHECKPOINT_SIZE
+                or time.monotonic() - self._flushed_at >= MAILING_CHECKPOINT_INTERVAL):
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Сохраняет накопленные статусы одной транзакцией"""
+        async with self._lock:
+            batch, self._batch, self._size = self._batch, {}, 0
+            self._flushed_at = time.monotonic()
+            if not batch:
+                return
+            try:
+                async with Session() as db:
+                    for (status, error), user_ids in batch.items():
+                        await db.execute(
+                            update(MailingDelivery)
+                            .where(MailingDelivery.job_id == self.job_id, MailingDelivery.user_id.in_(user_ids))
+                            .values(status=status, error=error)
+                            .execution_options(synchronize_session=False)
+                        )
+                    await db.commit()
+            except BaseException:
+                # Статусы остаются в очереди и сохраняются при следующей попытке (в том числе при отмене рассылки)
+                for key, user_ids in batch.items():
+                    self._batch.setdefault(key, []).extend(user_ids)
+                    self._size += len(user_ids)
+                raise
+
+
+async def create_job(payload: MailingPayload, admin_id: int, audience: Audience = Audience()) -> int:
+    """
+    Создает задание рассылки в статусе preparing. Список получателей
+    (по условиям audience) заполняется при выполнении задания (execute_job).
+
+    Возвращает:
+        int: ID задания
+    """
+    async with Session() as db:
+        job = MailingJob(payload=payload.to_json(), audience=audience.to_json(), admin_id=admin_id,
+                         status="preparing")
+        db.add(job)
+        await db.commit()
+    return job.id
+
+
+async def fill_job(job_id: int) -> None:
+    """
+    Добавляет в задание всех получателей (по условиям задания) со статусом
+    pending и переводит задание в статус running.
+
+    Получатели читаются из пула чтения и записываются короткими транзакциями
+    по одной порции, поэтому долгая выборка не блокирует другие записи в БД.
+    Повторный вызов (после сбоя на этом шаге) уже добавленных не дублирует.
+    """
+    async with Session() as db:
+        job = await db.get(MailingJob, job_id)
+    audience = Audience.from_data(json.loads(job.audience) if job.audience else None)
+    async for user_ids in iter_recipients(audience):
+        async with Session() as db:
+            await db.execute(
+                dialect_insert(MailingDelivery)
+                .values([{"job_id": job_id, "user_id": user_id, "status": PENDING} for user_id in user_ids])
+                .on_conflict_do_nothing()
+            )
+            await db.commit()
+    async with Session() as db:
+        await db.execute(update(MailingJob).where(MailingJob.id == job_id).values(status="running"))
+        await db.commit()
+
+
+async def iter_pending(job_id: int, chunk_size: int = 1000) -> AsyncIterator[int]:
+    """Выдает получателей задания со статусом pending порциями по chunk_size"""
+    last_user_id = None
+    while True:
+        query = (
+            select(MailingDelivery.user_id)
+            .where(MailingDelivery.job_id == job_id, MailingDelivery.status == PENDING)
+            .order_by(MailingDelivery.user_id)
+            .limit(chunk_size)
+        )
+        if last_user_id is not None:
+            query = query.where(MailingDelivery.user_id > last_user_id)
+        async with ReadSession() as db:
+            user_ids = (await db.execute(query)).scalars().all()
+        if not user_ids:
+            return
+        for user_id in user_ids:
+            yield user_id
+        last_user_id = user_ids[-1]
+
+
+async def job_report(job_id: int) -> str:
+    """Формирует итоговый отчет о рассылке: доставлено и ошибки по типам"""
+    async with Session() as db:
+        result = await db.execute(
+            select(MailingDelivery.status, MailingDelivery.error, func.count())
+            .where(MailingDelivery.job_id == job_id)
+            .group_by(MailingDelivery.status, MailingDelivery.error)
+        )
+        rows = result.all()
+
+    sent = sum(count for status, _, count in rows if status == SENT)
+    errors = Counter()
+    for status, error, count in rows:
+        if status in (FAILED, BLOCKED):
+            errors[error or ERROR_OTHER] += count
+
+    lines = [f"Сообщение отправлено {sent} юзерам"]
+    if errors:
+        lines.append("Не доставлено:")
+        for error, title in ERROR_TITLES.items():
+            if errors[error]:
+                lines.append(f"— {title}: {errors[error]}")
+    return "\n".join(lines)
+
+
+async def prune_blocked(job_id: int) -> None:
+    """Одним UPDATE помечает заблокированными всех, кто при рассылке ответил Forbidden"""
+    async with Session() as db:
+        result = await db.execute(
+            update(User)
+            .where(User.id.in_(
+                select(MailingDelivery.user_id)
+                .where(MailingDelivery.job_id == job_id, MailingDelivery.status == BLOCKED)
+            ), User.is_blocked == False)
+            .values(is_blocked=True, blocked_at=func.coalesce(User.blocked_at, datetime.datetime.now()))
+            .execution_options(synchronize_session=False)
+        )
+        await add_daily(db, blocked=result.rowcount)
+        await db.commit()
+
+
+async def count_pending(job_id: int) -> int:
+    """Возвращает количество получателей задания, которым сообщение еще не отправлялось"""
+    async with ReadSession() as db:
+        return await db.scalar(
+            select(func.count())
+            .select_from(MailingDelivery)
+            .where(MailingDelivery.job_id == job_id, MailingDelivery.status == PENDING)
+        )
+
+
+async def finish_job(job_id: int, status: str = "finished") -> None:
+    """Помечает заблокировавших бота получателей и закрывает задание с указанным статусом"""
+    await prune_blocked(job_id)
+    async with Session() as db:
+        await db.execute(
+            update(MailingJob)
+            .where(MailingJob.id == job_id)
+            .values(status=status, finished_at=datetime.datetime.now())
+        )
+        await db.commit()
+
+
+async def run_job(job_id: int, progress: Optional[ProgressFunc] = None) -> str:
+    """
+    Выполняет (или продолжает) рассылку по всем получателям со статусом pending.
+
+    Ошибки отправки не отправляются администратору по одной: они сохраняются
+    в статусах доставки с типом ошибки и попадают в итоговый отчет. После
+    рассылки получатели, заблокировавшие бота, помечаются в users, и
+    следующие рассылки их пропускают.
+
+    Параметры:
+        job_id: ID задания
+        progress: вызывается каждые PROGRESS_INTERVAL секунд и в конце
+
+    Возвращает:
+        str: итоговый отчет о рассылке
+    """
+    async with Session() as db:
+        job = await db.get(MailingJob, job_id)
+    send = MailingPayload.from_data(json.loads(job.payload)).sender()
+    ledger = DeliveryLedger(job_id)
+    counts = {"sent": 0, "failed": 0}
+    total = await count_pending(job_id)
+
+    async def on_sent(user_id: int) -> None:
+        counts["sent"] += 1
+        await ledger.record(user_id, SENT)
+
+    async def on_error(user_id: int, error: Exception) -> None:
+        counts["failed"] += 1
+        error_type = classify_error(error)
+        await ledger.record(user_id, BLOCKED if error_type == ERROR_BLOCKED else FAILED, error_type)
+
+    async def report_progress() -> None:
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            await progress(counts["sent"], counts["failed"], total)
+
+    reporter = asyncio.create_task(report_progress()) if progress else None
+    try:
+        # Рассылка отправляется с низшим приоритетом: ответы пользователям ее опережают
+        with outbound_priority(PRIORITY_BULK):
+            await broadcast(iter_pending(job_id), send, on_error=on_error, on_sent=on_sent)
+    finally:
+        if reporter:
+            reporter.cancel()
+        await ledger.flush()
+
+    if progress:
+        await progress(counts["sent"], counts["failed"], total)
+    await finish_job(job_id)
+    return await job_report(job_id)
+
+
+async def execute_job(job_id: int, progress: Optional[ProgressFunc] = None) -> str:
+    """
+    Заполняет список получателей (если задание еще готовится) и выполняет рассылку.
+
+    Если рассылку остановил администратор (cancel_job), задание закрывается
+    со статусом cancelled и больше не возобновляется. При любой другой отмене
+    (остановка бота) задание остается незавершенным и продолжится после запуска.
+
+    Возвращает:
+        str: итоговый отчет о рассылке
+    """
+    try:
+        async with Session() as db:
+            job = await db.get(MailingJob, job_id)
+        if job.status == "preparing":
+            await fill_job(job_id)
+        return await run_job(job_id, progress)
+    except asyncio.CancelledError:
+        if job_id not in _cancel_requested:
+            raise
+        _cancel_requested.discard(job_id)
+        await finish_job(job_id, "cancelled")
+        return "Рассылка остановлена.\n" + await job_report(job_id)
+
+
+def progress_text(job_id: int, sent: int, failed: int, total: int, elapsed: float) -> str:
+    """Формирует текст сообщения о ходе рассылки: отправлено, ошибки, осталось, скорость и оставшееся время"""
+    done = sent + failed
+    remaining = max(total - done, 0)
+    rate = done / elapsed if elapsed > 0 else 0.0
+    eta = str(datetime.timedelta(seconds=round(remaining / rate))) if rate else "—"
+    return (
+        f"Рассылка #{job_id}\n"
+        f"Отправлено: {sent}\n"
+        f"Ошибок: {failed}\n"
+        f"Осталось: {remaining} из {total}\n"
+        f"Скорость: {rate:.1f} сообщ./с\n"
+        f"Осталось времени: {eta}"
+    )
+
+
+def start_job(job_id: int, chat_id: int, on_done: Optional[Callable[[str], Awaitable[None]]] = None) -> asyncio.Task:
+    """
+    Запускает выполнение задания в фоне и сразу возвращается.
+
+    В чат chat_id отправляется одно сообщение о ходе рассылки с кнопкой
+    "Остановить", которое редактируется не чаще раза в PROGRESS_INTERVAL секунд.
+    По окончании в него записывается итоговый отчет и вызывается on_done.
+    Если рассылка упала с ошибкой, задание закрывается со статусом failed
+    (не возобновляется), а в отчет попадает текст ошибки.
+
+    Возвращает:
+        asyncio.Task: задача рассылки (также хранится в running_jobs)
+    """
+
+    async def run() -> None:
+        message = None
+        try:
+            message = await bot.send_message(chat_id, f"Рассылка #{job_id} готовится...",
+                                             reply_markup=stop_keyboard(job_id))
+        except Exception as e:
+            logger.warning(f"Не удалось отправить сообщение о ходе рассылки #{job_id}: {e}")
+        started = time.monotonic()
+
+        async def progress(sent: int, failed: int, total: int) -> None:
+            if message is None:
+                return
+            try:
+                await message.edit_text(progress_text(job_id, sent, failed, total, time.monotonic() - started),
+                                        reply_markup=stop_keyboard(job_id))
+            except TelegramBadRequest:
+                pass
+
+        try:
+            report = await execute_job(job_id, progress)
+        except Exception as e:
+            logger.exception(f"Ошибка рассылки #{job_id}")
+            report = f"Рассылка прервана из-за ошибки: {e}"
+            try:
+                await finish_job(job_id, "failed")
+            except Exception:
+                # Задание осталось незавершенным и продолжится после перезапуска
+                logger.exception(f"Не удалось закрыть рассылку #{job_id}")
+        if message is not None:
+            try:
+                await message.edit_text(f"Рассылка #{job_id}\n{report}")
+            except TelegramBadRequest:
+                pass
+        if on_done:
+            await on_done(report)
+
+    task = run_in_background(run())
+    running_jobs[job_id] = task
+    task.add_done_callback(lambda _: running_jobs.pop(job_id, None))
+    return task
+
+
+def cancel_job(job_id: int) -> bool:
+    """
+    Останавливает выполняющуюся рассылку.
+
+    Возвращает:
+        bool: False, если рассылка с таким ID сейчас не выполняется
+    """
+    task = running_jobs.get(job_id)
+    if task is None or task.done():
+        return False
+    _cancel_requested.add(job_id)
+    task.cancel()
+    return True
+
+
+async def resume_jobs() -> None:
+    """Продолжает в фоне рассылки, прерванные перезапуском бота"""
+    async with Session() as db:
+        result = await db.execute(select(MailingJob).where(MailingJob.status.in_(("preparing", "running"))))
+        jobs = result.scalars().all()
+
+    for job in jobs:
+        admin_ids = [job.admin_id] if job.admin_id else ADMIN_IDS
+        if not admin_ids:
+            logger.warning(f"Рассылка #{job.id} не возобновлена: не задан администратор для отчета (ADMIN_IDS)")
+            continue
+        logger.info(f"Возобновление рассылки #{job.id}")
+
+        async def on_done(report: str, job_id: int = job.id, admin_ids: List[int] = admin_ids) -> None:
+            for admin_id in admin_ids:
+                try:
+                    await bot.send_message(
+                        admin_id,
+                        f"Рассылка #{job_id} возобновлена после перезапуска и завершена.\n{report}"
+                    )
+                except Exception as e:
+                    logger.warning(f"Не удалось отправить отчет о рассылке #{job_id}: {e}")
+
+        start_job(job.id, admin_ids[0], on_done)
@@ -2,12 +2,24 @@ import asyncio
 import logging
 
 from aiogram import Dispatcher
+from aiohttp import web
 
 import handlers_admin
 import handlers_user
 from bot import bot
-from db.models import create_tables
-from typing import NoReturn
+from buffers import user_status_buffer, join_request_buffer
+from channel_links import channel_link_cache
+from config import BOT_MODE, DROP_PENDING_UPDATES
+from db.models import create_tables, engine, read_engine
+from fsm_storage import create_fsm_storage
+from mailing import resume_jobs, run_in_background
+from outbound import outbound_scheduler
+from retention import retention_worker
+from metrics import (CallbackCounter, CallbackGauge, TelegramApiMetricsMiddleware, instrument_dispatcher,
+                     instrument_engine, start_metrics_server)
+from scheduler import follow_up_scheduler
+from webhook import run_webhook
+from typing import NoReturn, Optional
 
 logger: logging.Logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -15,6 +27,55 @@ logging.basicConfig(
             format="%(asctime)s - %(levelname)s - %(name)s - %(message)s"
         )
 
+# Размеры очередей, ожидающих записи в БД или отправки
+CallbackGauge(
+    "bot_pending_items", "Количество событий в буферах записи и отложенных сообщений",
+    lambda: {
+        ("join_requests",): len(join_request_buffer),
+        ("user_status",): len(user_status_buffer),
+        ("follow_ups",): len(follow_up_scheduler),
+    },
+    ["queue"],
+)
+# Отправки, ожидающие своей очереди в общей очереди исходящих сообщений
+CallbackGauge(
+    "bot_outbound_queued", "Отправки, ожидающие очереди, по приоритетам",
+    lambda: {(priority,): count for priority, count in outbound_scheduler.queued().items()},
+    ["priority"],
+)
+# Пропущенные и отброшенные повторные события пользователей
+CallbackCounter(
+    "bot_throttled_events_total", "События, пропущенные и отброшенные защитой от повторов",
+    lambda: {
+        (middleware.name, result): count
+        for middleware in (handlers_user.message_throttling, handlers_user.join_request_throttling)
+        for result, count in middleware.stats.items()
+    },
+    ["event", "result"],
+)
+
+
+async def shutdown(metrics_runner: Optional[web.AppRunner] = None, dp: Optional[Dispatcher] = None) -> None:
+    """
+    Корректно завершает работу: останавливает сервер метрик, хранилище FSM,
+    перенос запросов в архив и планировщик отложенных сообщений, сохраняет
+    в БД события, оставшиеся в буферах, и закрывает HTTP-сессию Bot API.
+
+    Вызывается из main() при любом завершении, в том числе при остановке
+    бота через run_app (Ctrl+C), пока цикл событий еще работает.
+    """
+    if metrics_runner:
+        await metrics_runner.cleanup()
+    if dp:
+        await dp.storage.close()
+    await retention_worker.stop()
+    await follow_up_scheduler.stop()
+    await join_request_buffer.stop()
+    await user_status_buffer.stop()
+    logger.info("Буферы записи в БД сохранены")
+    # Закрываем пул соединений с Telegram (после polling он уже закрыт, повторно не мешает)
+    await bot.session.close()
+
 
 async def main() -> None:
     """
@@ -22,22 +83,31 @@ async def main() -> None:
 
     Эта функция:
     1. Инициализирует таблицы в базе данных
-    2. Настраивает логирование
-    3. Регистрирует обработчики сообщений
-    4. Запускает бота в режиме long-polling
+    2. Возобновляет незавершенные рассылки
+    3. Настраивает логирование
+    4. Регистрирует обработчики сообщений
+    5. Запускает бота в режиме long-polling или webhook (BOT_MODE)
 
     Шаги выполнения:
     1. Создание таблиц БД (если не существуют)
     2. Настройка уровня логирования (INFO)
     3. Инициализация диспетчера
     4. Регистрация роутеров (пользовательские и административные обработчики)
-    5. Удаление ожидающих апдейтов
-    6. Запуск опроса серверов Telegram
+    5. Удаление вебхука (для long-polling)
+    6. Запуск опроса серверов Telegram или webhook-сервера
 
     Обработка ошибок:
         Ловит и логирует все исключения во время работы
     """
+    metrics_runner = None
+    dp: Optional[Dispatcher] = None
     try:
+        # Замер времени запросов к БД и к Telegram, страница метрик
+        instrument_engine(engine, "write")
+        instrument_engine(read_engine, "read")
+        bot.session.middleware(TelegramApiMetricsMiddleware())
+        metrics_runner = await start_metrics_server()
+
         # Инициализация таблиц в базе данных
         await create_tables()
         try:
@@ -47,26 +117,49 @@ async def main() -> None:
         # Настройка базового логирования
         logger.info("Инициализация таблиц базы данных завершена")
 
-        # Создание диспетчера для обработки событий
-        dp: Dispatcher = Dispatcher()
+        # Загрузка ссылки на канал в кэш
+        await channel_link_cache.load()
+
+        # Запуск буферов отложенной записи в БД
+        user_status_buffer.start()
+        join_request_buffer.start()
+
+        # Запуск планировщика отложенных сообщений
+        await follow_up_scheduler.start()
+
+        # Перенос старых запросов на подписку в архив (если задан RETENTION_DAYS)
+        retention_worker.start()
+
+        # Продолжение рассылок, прерванных перезапуском
+        run_in_background(resume_jobs())
+
+        # Создание диспетчера; состояния FSM хранятся вне процесса (FSM_STORAGE) и переживают перезапуск
+        dp = Dispatcher(storage=create_fsm_storage())
 
         # Регистрация роутеров
         dp.include_router(handlers_admin.router)
         dp.include_router(handlers_user.router)
+        instrument_dispatcher(dp)
         logger.info("Роутеры успешно зарегистрированы")
 
-        # Удаление вебхука для очистки ожидающих обновлений
-        await bot.delete_webhook(drop_pending_updates=True)
-        logger.info("Ожидающие обновления очищены")
+        if BOT_MODE == "webhook":
+            # Запуск бота в режиме webhook
+            logger.info("Запуск бота в режиме webhook...")
+            await run_webhook(dp, bot)
+        else:
+            # Удаление вебхука (накопившиеся обновления сохраняются, если не задан DROP_PENDING_UPDATES)
+            await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
 
-        # Запуск бота в режиме long-polling
-        logger.info("Запуск бота в режиме long-polling...")
-        await dp.start_polling(bot)
+            # Запуск бота в режиме long-polling
+            logger.info("Запуск бота в режиме long-polling...")
+            await dp.start_polling(bot)
 
 
     except Exception as e:
         logger.exception(f"Критическая ошибка: {str(e)}")
         raise
+    finally:
+        await shutdown(metrics_runner, dp)
 
 
 def run_app() -> NoReturn:
@@ -0,0 +1,255 @@
+"""
+Метрики производительности бота в текстовом формате Prometheus.
+
+Собираются:
+    - время обработки обновлений по обработчикам (bot_handler_duration_seconds);
+    - количество и время запросов к БД (db_query_duration_seconds);
+    - время запросов к Telegram Bot API по методам (telegram_api_duration_seconds);
+    - результаты отправок в рассылках и при одобрении заявок (broadcast_messages_total, метка kind);
+    - ожидание в очереди исходящих сообщений по приоритетам (bot_outbound_wait_seconds).
+
+Страница метрик отдается на http://METRICS_HOST:METRICS_PORT/metrics:
+
+    curl http://127.0.0.1:9101/metrics
+"""
+import bisect
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import Bot, Dispatcher, BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from config import METRICS_HOST, METRICS_PORT
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм (секунды)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Metric(ABC):
+    """Базовый класс метрики с набором меток"""
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Строки значений метрики в текстовом формате Prometheus"""
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+
+class Counter(Metric):
+    """Счетчик, который только растет"""
+    type = "counter"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    """Гистограмма длительностей (количество, сумма и распределение по корзинам)"""
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        # Для каждого набора меток: попадания в корзины (последняя - +Inf), сумма
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = state
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def _samples(self) -> List[str]:
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (le,))} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total[0]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CallbackGauge(Metric):
+    """Значение, которое вычисляется функцией в момент запроса метрик (размер очереди и т.п.)"""
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], Dict[LabelValues, float]],
+                 labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self.func().items()]
+
+
+class CallbackCounter(CallbackGauge):
+    """Счетчик, который ведется в другом месте и вычисляется функцией в момент запроса метрик"""
+    type = "counter"
+
+
+registry: List[Metric] = []
+
+
+def render() -> str:
+    """Возвращает все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+handler_duration = Histogram("bot_handler_duration_seconds", "Время работы обработчика обновления",
+                             ["event", "handler"])
+handler_errors = Counter("bot_handler_errors_total", "Исключения в обработчиках", ["event", "handler"])
+db_query_duration = Histogram("db_query_duration_seconds", "Время выполнения запросов к БД", ["engine", "statement"])
+telegram_api_duration = Histogram("telegram_api_duration_seconds", "Время запросов к Telegram Bot API",
+                                  ["method", "result"])
+broadcast_messages = Counter("broadcast_messages_total", "Результаты отправок пулом broadcast по видам",
+                             ["kind", "result"])
+outbound_wait = Histogram("bot_outbound_wait_seconds", "Ожидание отправки в очереди исходящих сообщений",
+                          ["priority"])
+
+
+class HandlerLatencyMiddleware(BaseMiddleware):
+    """Inner-middleware, замеряющее время работы каждого обработчика"""
+
+    def __init__(self, event_name: str) -> None:
+        self.event_name = event_name
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(handler_object.callback, "__name__", "unknown") if handler_object else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(event=self.event_name, handler=name)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - started, event=self.event_name, handler=name)
+
+
+class TelegramApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота, замеряющее время запросов к Bot API"""
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ) -> Any:
+        started = time.perf_counter()
+        result = "ok"
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            result = type(e).__name__
+            raise
+        finally:
+            telegram_api_duration.observe(time.perf_counter() - started, method=method.__api_method__,
+                                          result=result)
+
+
+def instrument_engine(engine: AsyncEngine, name: str) -> None:
+    """Подключает замер времени запросов к движку SQLAlchemy"""
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        db_query_duration.observe(time.perf_counter() - started, engine=name,
+                                  statement=statement.lstrip().split(None, 1)[0].upper())
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(context):
+        # after_cursor_execute при ошибке не вызывается: убираем время начала упавшего запроса,
+        # иначе следующие замеры на этом соединении возьмут чужое время
+        conn = context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+
+def instrument_dispatcher(dp: Dispatcher) -> None:
+    """Подключает замер времени обработчиков ко всем типам событий диспетчера"""
+    for event_name, observer in dp.observers.items():
+        if event_name not in ("update", "error"):
+            observer.middleware(HandlerLatencyMiddleware(event_name))
+
+
+async def start_metrics_server() -> Optional[web.AppRunner]:
+    """
+    Запускает HTTP-сервер со страницей /metrics.
+
+    Возвращает:
+        Optional[web.AppRunner]: runner сервера (None, если METRICS_PORT = 0)
+    """
+    if not METRICS_PORT:
+        return None
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=METRICS_HOST, port=METRICS_PORT).start()
+    logger.info(f"Метрики доступны на http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
@@ -0,0 +1,64 @@
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Message, ChatJoinRequest
+
+
+def event_key(event: TelegramObject) -> Optional[Hashable]:
+    """
+    Ключ, по которому события считаются повторными:
+    запрос того же пользователя в тот же канал или то же сообщение от того же пользователя
+    """
+    if isinstance(event, ChatJoinRequest):
+        return event.from_user.id, event.chat.id
+    if isinstance(event, Message) and event.from_user:
+        return event.from_user.id, event.text
+    return None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Outer-middleware, отбрасывающее повторные события пользователя.
+
+    Событие с тем же ключом (см. event_key), пришедшее в течение window секунд
+    после пропущенного, до обработчика не доходит. Состояние - словарь
+    ключ -> время истечения, просроченные записи удаляются не чаще раза
+    в window секунд. Счетчики пропущенных и отброшенных событий - в stats.
+    """
+
+    def __init__(self, window: float, name: str) -> None:
+        self.window = window
+        self.name = name
+        self.stats: Counter = Counter()
+        self._expires: Dict[Hashable, float] = {}
+        self._next_cleanup = 0.0
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    def _cleanup(self, now: float) -> None:
+        self._expires = {key: expires for key, expires in self._expires.items() if expires > now}
+        self._next_cleanup = now + self.window
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        key = event_key(event)
+        if key is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        if now >= self._next_cleanup:
+            self._cleanup(now)
+        if self._expires.get(key, 0.0) > now:
+            self.stats["dropped"] += 1
+            return None
+
+        self._expires[key] = now + self.window
+        self.stats["passed"] += 1
+        return await handler(event, data)
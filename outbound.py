@@ -0,0 +1,155 @@
+"""
+Общая очередь исходящих сообщений бота.
+
+Все отправки сообщений (send*, copyMessage, forwardMessage) проходят через
+middleware сессии бота OutboundScheduler, который соблюдает лимиты Telegram:
+не чаще одного сообщения в OUTBOUND_CHAT_INTERVAL секунд в один чат и не
+больше OUTBOUND_RATE сообщений в секунду на бота. Когда свободной скорости
+не хватает, первыми отправляются сообщения с более высоким приоритетом:
+ответы пользователям и администратору, затем отложенные сообщения, затем
+рассылки. Приоритет задается для блока кода через контекст:
+
+    with outbound_priority(PRIORITY_BULK):
+        await broadcast(...)
+
+Задачи, созданные внутри блока, наследуют его приоритет.
+"""
+import asyncio
+import contextlib
+import heapq
+import itertools
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from broadcast import TokenBucket
+from config import OUTBOUND_RATE, OUTBOUND_CHAT_INTERVAL, OUTBOUND_MAX_RETRIES
+from metrics import outbound_wait
+
+# Приоритеты отправки (меньше - важнее)
+PRIORITY_INTERACTIVE = 0  # Ответы пользователям и администратору
+PRIORITY_FOLLOW_UP = 1  # Отложенные сообщения
+PRIORITY_BULK = 2  # Рассылки
+
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_FOLLOW_UP: "follow_up", PRIORITY_BULK: "bulk"}
+
+# Методы, которые отправляют сообщение в чат и подчиняются лимитам
+SCHEDULED_PREFIXES = ("send", "copy", "forward")
+UNSCHEDULED_METHODS = {"sendChatAction"}
+
+_priority: ContextVar[int] = ContextVar("outbound_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextlib.contextmanager
+def outbound_priority(priority: int) -> Iterator[None]:
+    """Задает приоритет отправок внутри блока with (и в созданных в нем задачах)"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: очередь отправок с приоритетами.
+
+    Очередь к чату - время, с которого в него можно отправить следующее
+    сообщение; оно резервируется при постановке в очередь, поэтому сообщения
+    в один чат уходят по порядку. Дождавшись своего времени, отправка встает
+    в общую кучу по приоритету, из которой единственная задача выдает
+    разрешения со скоростью rate. Ответ 429 приостанавливает выдачу для всех;
+    ответы и отложенные сообщения после паузы снова встают в очередь (не более
+    max_retries раз), а рассылкам ошибка передается сразу - их повторяет broadcast.
+
+    Параметры:
+        rate: сообщений в секунду на бота
+        chat_interval: минимальный интервал между сообщениями в один чат (секунды)
+        max_retries: количество повторов после 429 для отправок выше PRIORITY_BULK
+    """
+
+    def __init__(self, rate: float = OUTBOUND_RATE, chat_interval: float = OUTBOUND_CHAT_INTERVAL,
+                 max_retries: int = OUTBOUND_MAX_RETRIES) -> None:
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(rate)
+        self._chat_next: Dict[Union[int, str], float] = {}
+        self._next_cleanup = 0.0
+        self._heap: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    def queued(self) -> Counter:
+        """Количество отправок, ожидающих разрешения, по приоритетам"""
+        return Counter(PRIORITY_NAMES[priority] for priority, _, future in self._heap if not future.done())
+
+    def _reserve_chat(self, chat_id: Union[int, str]) -> float:
+        """Резервирует для чата ближайшее свободное время отправки и возвращает его"""
+        now = time.monotonic()
+        if now >= self._next_cleanup:
+            self._chat_next = {key: at for key, at in self._chat_next.items() if at > now}
+            self._next_cleanup = now + 60
+        send_at = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = send_at + self.chat_interval
+        return send_at
+
+    async def _dispatch(self) -> None:
+        """Выдает разрешения ожидающим отправкам по приоритету, пока очередь не опустеет"""
+        try:
+            while self._heap:
+                await self._bucket.acquire()
+                # За время ожидания токена могли прийти отправки важнее - берем лучшую
+                while self._heap:
+                    _, _, future = heapq.heappop(self._heap)
+                    if not future.done():
+                        future.set_result(None)
+                        break
+        finally:
+            self._task = None
+
+    async def acquire(self, chat_id: Union[int, str, None], priority: int) -> None:
+        """Ждет, пока отправку в чат chat_id с приоритетом priority можно выполнить"""
+        started = time.monotonic()
+        if chat_id is not None and self.chat_interval:
+            delay = self._reserve_chat(chat_id) - started
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._counter), future))
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+        await future
+        outbound_wait.observe(time.monotonic() - started, priority=PRIORITY_NAMES[priority])
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ) -> Any:
+        name = method.__api_method__
+        if not name.startswith(SCHEDULED_PREFIXES) or name in UNSCHEDULED_METHODS:
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        priority = _priority.get()
+        retries = 0 if priority >= PRIORITY_BULK else self.max_retries
+        for attempt in range(retries + 1):
+            await self.acquire(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self._bucket.pause(e.retry_after)
+                if attempt == retries:
+                    raise
+
+
+outbound_scheduler = OutboundScheduler()
@@ -0,0 +1,175 @@
+"""
+Хранение и сжатие subscription_requests.
+
+Строки старше RETENTION_DAYS дней переносятся в компактную таблицу
+subscription_requests_archive короткими транзакциями по RETENTION_BATCH_SIZE
+строк, после чего освободившиеся страницы возвращаются системе через
+PRAGMA incremental_vacuum (тоже небольшими шагами).
+
+Архив учитывают выбор получателей рассылки по каналу и периоду (mailing.Audience)
+и выбор ссылки по каналу последнего запроса (channel_links). Выгрузка
+и одобрение заявок работают только с subscription_requests: перенесенные
+запросы в них не попадают.
+
+Новые базы SQLite создаются с auto_vacuum=INCREMENTAL. Существующую базу
+нужно один раз перевести в этот режим полным VACUUM при остановленном боте:
+
+    python retention.py --enable-incremental-vacuum
+"""
+import argparse
+import asyncio
+import datetime
+import logging
+from typing import Optional
+
+from sqlalchemy import select, insert, delete
+
+from config import RETENTION_DAYS, RETENTION_BATCH_SIZE, RETENTION_INTERVAL, RETENTION_VACUUM_PAGES
+from db.models import engine, Session, SubscriptionRequest, SubscriptionRequestArchive
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Пауза между пачками, чтобы между ними успевали записываться события бота (секунды)
+BATCH_PAUSE = 0.05
+
+ARCHIVE_COLUMNS = ["id", "user_id", "channel_id", "time_request", "approve_status"]
+
+
+class RetentionWorker:
+    """
+    Фоновый перенос старых запросов в архив и освобождение места в файле БД.
+
+    Запускается start() и останавливается stop(); при days = 0 ничего не делает.
+    """
+
+    def __init__(self, days: int = RETENTION_DAYS, batch_size: int = RETENTION_BATCH_SIZE,
+                 interval: float = RETENTION_INTERVAL, vacuum_pages: int = RETENTION_VACUUM_PAGES) -> None:
+        self.days = days
+        self.batch_size = batch_size
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+        self._task: Optional[asyncio.Task] = None
+
+    async def archive_batch(self, cutoff: datetime.datetime) -> int:
+        """
+        Переносит в архив одну пачку самых старых запросов, сделанных раньше cutoff.
+
+        Возвращает:
+            int: количество перенесенных строк
+        """
+        batch = (
+            select(SubscriptionRequest.id)
+            .where(SubscriptionRequest.time_request < cutoff)
+            .order_by(SubscriptionRequest.time_request, SubscriptionRequest.id)
+            .limit(self.batch_size)
+            .scalar_subquery()
+        )
+        async with Session() as db:
+            await db.execute(
+                insert(SubscriptionRequestArchive).from_select(
+                    ARCHIVE_COLUMNS,
+                    select(*(getattr(SubscriptionRequest, column) for column in ARCHIVE_COLUMNS))
+                    .where(SubscriptionRequest.id.in_(batch))
+                )
+            )
+            result = await db.execute(
+                delete(SubscriptionRequest)
+                .where(SubscriptionRequest.id.in_(batch))
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        return result.rowcount
+
+    async def archive(self) -> int:
+        """Переносит в архив все запросы старше days дней. Возвращает количество строк"""
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=self.days)
+        total = 0
+        while True:
+            moved = await self.archive_batch(cutoff)
+            total += moved
+            if moved < self.batch_size:
+                return total
+            await asyncio.sleep(BATCH_PAUSE)
+
+    async def vacuum(self) -> int:
+        """
+        Возвращает системе свободные страницы файла БД шагами по vacuum_pages
+        и сбрасывает WAL. Работает только для SQLite с auto_vacuum=INCREMENTAL.
+
+        Возвращает:
+            int: количество освобожденных страниц
+        """
+        if engine.dialect.name != "sqlite":
+            return 0
+        released = 0
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            if (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar() != 2:
+                logger.info("auto_vacuum не включен, место в файле БД будет переиспользовано без сжатия "
+                            "(см. python retention.py --enable-incremental-vacuum)")
+                return 0
+            while True:
+                free_pages = (await conn.exec_driver_sql("PRAGMA freelist_count")).scalar()
+                if not free_pages:
+                    break
+                await conn.exec_driver_sql(f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+                released += min(free_pages, self.vacuum_pages)
+                await asyncio.sleep(BATCH_PAUSE)
+            await conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        return released
+
+    async def run_once(self) -> None:
+        """Переносит старые запросы в архив и освобождает место в файле БД"""
+        if not self.days:
+            return
+        archived = await self.archive()
+        released = await self.vacuum() if archived else 0
+        if archived:
+            logger.info(f"Перенесено в архив запросов: {archived}, освобождено страниц БД: {released}")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Ошибка переноса запросов в архив")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """Запускает фоновый перенос (если задан срок хранения)"""
+        if self.days and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def enable_incremental_vacuum() -> None:
+    """Переводит существующую базу SQLite в режим auto_vacuum=INCREMENTAL (полный VACUUM)"""
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        await conn.exec_driver_sql("VACUUM")
+        mode = (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar()
+    logger.info(f"auto_vacuum = {mode}")
+
+
+retention_worker = RetentionWorker()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Перенос старых запросов в архив и сжатие БД")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="перевести БД в режим auto_vacuum=INCREMENTAL (бот должен быть остановлен)")
+    args = parser.parse_args()
+    if args.enable_incremental_vacuum:
+        asyncio.run(enable_incremental_vacuum())
+    else:
+        asyncio.run(retention_worker.run_once())
@@ -0,0 +1,190 @@
+import asyncio
+import datetime
+import heapq
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramRetryAfter
+from sqlalchemy import select, delete, tuple_
+
+from bot import bot
+from buffers import WriteBehindBuffer, chunked
+from config import FOLLOW_UP_CONCURRENCY
+from db.models import Session, ScheduledMessage, dialect_insert
+from outbound import outbound_priority, PRIORITY_FOLLOW_UP
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Тексты отложенных сообщений; в БД хранится только ключ
+FOLLOW_UP_TEXTS: Dict[str, str] = {
+    "thanks": "🙏 Спасибо за вашу заявку на подписку! Модераторы рассмотрят её в ближайшее время! ⏰",
+}
+
+# (ID получателя, ключ текста)
+Key = Tuple[int, str]
+
+
+class ScheduledMessageStore(WriteBehindBuffer):
+    """Буфер записи отложенных сообщений: новые сохраняются, отправленные удаляются пачкой"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._new: Dict[Key, datetime.datetime] = {}
+        self._sent: Set[Key] = set()
+
+    def __len__(self) -> int:
+        return len(self._new) + len(self._sent)
+
+    def add(self, key: Key, send_at: datetime.datetime) -> None:
+        self._new[key] = send_at
+        self._added()
+
+    def remove(self, key: Key) -> None:
+        # Сообщение, которое еще не попало в БД, удалять из нее не нужно
+        if self._new.pop(key, None) is None:
+            self._sent.add(key)
+            self._added()
+
+    def _take(self) -> Tuple[Dict[Key, datetime.datetime], Set[Key]]:
+        batch = (self._new, self._sent)
+        self._new, self._sent = {}, set()
+        return batch
+
+    def _restore(self, batch: Tuple[Dict[Key, datetime.datetime], Set[Key]]) -> None:
+        new, sent = batch
+        for key, send_at in new.items():
+            # Сообщение успели отправить и удалить после неудачной попытки - сохранять его не нужно
+            if key in self._sent:
+                self._sent.discard(key)
+            else:
+                self._new.setdefault(key, send_at)
+        # Удаления из старой пачки тоже выполняются при следующей попытке
+        self._sent |= sent
+
+    async def _write(self, batch: Tuple[Dict[Key, datetime.datetime], Set[Key]]) -> None:
+        new, sent = batch
+        async with Session() as db:
+            # Сначала удаления: ключ, удаленный и снова добавленный за время между
+            # сохранениями, должен остаться в БД
+            for chunk in chunked(list(sent)):
+                await db.execute(
+                    delete(ScheduledMessage)
+                    .where(tuple_(ScheduledMessage.chat_id, ScheduledMessage.template).in_(chunk))
+                )
+            for chunk in chunked(list(new.items())):
+                stmt = dialect_insert(ScheduledMessage).values([
+                    {"chat_id": chat_id, "template": template, "send_at": send_at}
+                    for (chat_id, template), send_at in chunk
+                ])
+                await db.execute(stmt.on_conflict_do_update(
+                    index_elements=[ScheduledMessage.chat_id, ScheduledMessage.template],
+                    set_={"send_at": stmt.excluded.send_at},
+                ))
+            await db.commit()
+
+
+class FollowUpScheduler:
+    """
+    Планировщик отложенных сообщений.
+
+    Ожидающие сообщения лежат в куче (время отправки, получатель, ключ текста)
+    и обслуживаются одной фоновой задачей, которая спит до ближайшего срока.
+    Наступившие сообщения отправляются параллельно, не больше concurrency
+    одновременно, поэтому медленная отправка не задерживает остальные.
+    Копия хранится в таблице scheduled_messages, поэтому после перезапуска
+    сообщения не теряются. Повторное планирование того же сообщения тому же
+    получателю игнорируется, пока первое не отправлено.
+    """
+
+    def __init__(self, concurrency: int = FOLLOW_UP_CONCURRENCY) -> None:
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._sending: Set[asyncio.Task] = set()
+        self._heap: List[Tuple[float, int, str]] = []
+        self._pending: Set[Key] = set()
+        self._store = ScheduledMessageStore()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def schedule(self, chat_id: int, template: str, delay: float) -> None:
+        """Планирует отправку текста FOLLOW_UP_TEXTS[template] через delay секунд"""
+        key = (chat_id, template)
+        if key in self._pending:
+            return
+        send_at = time.time() + delay
+        self._pending.add(key)
+        heapq.heappush(self._heap, (send_at, chat_id, template))
+        self._store.add(key, datetime.datetime.fromtimestamp(send_at))
+        # Будим цикл, если новое сообщение стало ближайшим
+        if self._heap[0][0] == send_at:
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        """Загружает неотправленные сообщения из БД и запускает цикл отправки"""
+        async with Session() as db:
+            result = await db.execute(
+                select(ScheduledMessage.chat_id, ScheduledMessage.template, ScheduledMessage.send_at)
+            )
+            for chat_id, template, send_at in result:
+                self._pending.add((chat_id, template))
+                self._heap.append((send_at.timestamp(), chat_id, template))
+        heapq.heapify(self._heap)
+        logger.info(f"Загружено отложенных сообщений: {len(self._heap)}")
+        self._store.start()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает цикл отправки и сохраняет изменения в БД"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Прерванные отправки остаются в БД и будут повторены после запуска
+        for task in list(self._sending):
+            task.cancel()
+        await asyncio.gather(*self._sending, return_exceptions=True)
+        await self._store.stop()
+
+    async def _run(self) -> None:
+        while True:
+            if not self._heap or self._heap[0][0] > time.time():
+                timeout = self._heap[0][0] - time.time() if self._heap else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, chat_id, template = heapq.heappop(self._heap)
+            # Ждем свободного места, только если уже отправляется concurrency сообщений
+            await self._semaphore.acquire()
+            task = asyncio.create_task(self._send(chat_id, template))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat_id: int, template: str) -> None:
+        """Отправляет одно отложенное сообщение и освобождает место для следующего"""
+        try:
+            with outbound_priority(PRIORITY_FOLLOW_UP):
+                await bot.send_message(chat_id, FOLLOW_UP_TEXTS[template])
+        except TelegramRetryAfter as e:
+            # Повторяем отправку после паузы, указанной Telegram
+            heapq.heappush(self._heap, (time.time() + e.retry_after, chat_id, template))
+            self._wakeup.set()
+            return
+        except Exception as e:
+            logger.warning(f"Не удалось отправить отложенное сообщение {chat_id}: {e}")
+        finally:
+            self._semaphore.release()
+        self._pending.discard((chat_id, template))
+        self._store.remove((chat_id, template))
+
+
+follow_up_scheduler = FollowUpScheduler()
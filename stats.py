@@ -0,0 +1,110 @@
+import datetime
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.models import ReadSession, ChannelDailyStats, DailyStats, dialect_insert
+
+# За сколько последних дней показывать запросы по каналам
+STATS_DAYS = 7
+
+
+async def add_channel_requests(db: AsyncSession, counts: Dict[Tuple[datetime.date, int], int],
+                               names: Dict[int, str]) -> None:
+    """
+    Увеличивает счетчики запросов по (день, канал) в той же транзакции,
+    в которой сохраняются сами запросы.
+    """
+    if not counts:
+        return
+    stmt = dialect_insert(ChannelDailyStats).values([
+        {"day": day, "channel_id": channel_id, "channel_name": names.get(channel_id), "requests": count}
+        for (day, channel_id), count in counts.items()
+    ])
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[ChannelDailyStats.day, ChannelDailyStats.channel_id],
+        set_={
+            "requests": ChannelDailyStats.requests + stmt.excluded.requests,
+            "channel_name": func.coalesce(stmt.excluded.channel_name, ChannelDailyStats.channel_name),
+        },
+    ))
+
+
+async def add_daily(db: AsyncSession, day: Optional[datetime.date] = None, **deltas: int) -> None:
+    """
+    Увеличивает дневные счетчики (new_users, captcha_passed, blocked, unblocked)
+    в той же транзакции, в которой сохраняются события.
+    """
+    deltas = {name: value for name, value in deltas.items() if value}
+    if not deltas:
+        return
+    stmt = dialect_insert(DailyStats).values(day=day or datetime.date.today(), **deltas)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[DailyStats.day],
+        set_={name: getattr(DailyStats, name) + getattr(stmt.excluded, name) for name in deltas},
+    ))
+
+
+async def list_channels() -> List[Tuple[int, str]]:
+    """Возвращает каналы, в которые подавались запросы: (ID, название)"""
+    async with ReadSession() as db:
+        result = await db.execute(
+            select(ChannelDailyStats.channel_id, func.max(ChannelDailyStats.channel_name))
+            .group_by(ChannelDailyStats.channel_id)
+        )
+        return [(channel_id, name or str(channel_id)) for channel_id, name in result.all()]
+
+
+def _percent(part: int, total: int) -> str:
+    return f"{part / total:.1%}" if total else "—"
+
+
+async def stats_report(days: int = STATS_DAYS) -> str:
+    """
+    Формирует текст экрана статистики по сводным таблицам.
+
+    Запросы идут только к channel_daily_stats и daily_stats (строк - дни
+    и каналы), поэтому время ответа не зависит от размера subscription_requests.
+    """
+    since = datetime.date.today() - datetime.timedelta(days=days - 1)
+    async with ReadSession() as db:
+        users, captcha, blocked, unblocked = (await db.execute(
+            select(
+                func.coalesce(func.sum(DailyStats.new_users), 0),
+                func.coalesce(func.sum(DailyStats.captcha_passed), 0),
+                func.coalesce(func.sum(DailyStats.blocked), 0),
+                func.coalesce(func.sum(DailyStats.unblocked), 0),
+            )
+        )).one()
+        rows = (await db.execute(
+            select(ChannelDailyStats.channel_id, ChannelDailyStats.channel_name, ChannelDailyStats.day,
+                   ChannelDailyStats.requests)
+            .where(ChannelDailyStats.day >= since)
+            .order_by(ChannelDailyStats.channel_id, ChannelDailyStats.day)
+        )).all()
+
+    blocked = blocked - unblocked
+    lines = [
+        "📊 Статистика",
+        f"Пользователей: {users}",
+        f"Нажали «Я человек!»: {captcha} ({_percent(captcha, users)})",
+        f"Заблокировали бота: {blocked} ({_percent(blocked, users)})",
+        "",
+        f"Заявки за последние {days} дн.:",
+    ]
+    if not rows:
+        lines.append("нет заявок")
+
+    names: Dict[int, str] = {}
+    per_channel: Dict[int, List[Tuple[datetime.date, int]]] = {}
+    totals: Counter = Counter()
+    for channel_id, channel_name, day, requests in rows:
+        names[channel_id] = channel_name or names.get(channel_id) or str(channel_id)
+        per_channel.setdefault(channel_id, []).append((day, requests))
+        totals[channel_id] += requests
+    for channel_id, per_day in per_channel.items():
+        lines.append(f"{names[channel_id]} — {totals[channel_id]}")
+        lines.extend(f"  {day:%d.%m}: {requests}" for day, requests in per_day)
+    return "\n".join(lines)
@@ -0,0 +1,100 @@
+"""
+Режим webhook: aiohttp-сервер, принимающий обновления от Telegram.
+
+Для локальной проверки можно запустить бота с BOT_MODE=webhook и пустым
+WEBHOOK_URL и отправить записанное обновление вручную:
+
+    curl -X POST http://127.0.0.1:8080/webhook \
+         -H "Content-Type: application/json" \
+         -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \
+         -d @update.json
+"""
+import asyncio
+import logging
+import signal
+from contextlib import suppress
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import Bot, Dispatcher, BaseMiddleware
+from aiogram.types import TelegramObject
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import (WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET,
+                    WEBHOOK_MAX_CONNECTIONS, WEBHOOK_MAX_CONCURRENT_UPDATES, DROP_PENDING_UPDATES)
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """Ограничивает количество одновременно обрабатываемых обновлений"""
+
+    def __init__(self, limit: int) -> None:
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        async with self._semaphore:
+            return await handler(event, data)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """
+    Запускает aiohttp-сервер для приема обновлений и работает до остановки.
+
+    Запросы без правильного заголовка X-Telegram-Bot-Api-Secret-Token
+    отклоняются; без WEBHOOK_SECRET сервер не запускается, иначе любой, кто
+    может обратиться к порту, подделает обновление от администратора.
+    Обновления обрабатываются
+    в фоне, но не более WEBHOOK_MAX_CONCURRENT_UPDATES одновременно.
+    Работает до SIGTERM/SIGINT, после чего сервер останавливается и
+    main() выполняет штатное завершение (shutdown).
+    Накопившиеся за время простоя обновления не удаляются, если не
+    задан DROP_PENDING_UPDATES.
+    """
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("Для режима webhook нужно задать WEBHOOK_SECRET")
+
+    dp.update.outer_middleware(ConcurrencyLimitMiddleware(WEBHOOK_MAX_CONCURRENT_UPDATES))
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=DROP_PENDING_UPDATES
+        )
+        logger.info(f"Webhook зарегистрирован: {WEBHOOK_URL}{WEBHOOK_PATH}")
+    else:
+        logger.info("WEBHOOK_URL не задан, webhook в Telegram не регистрируется")
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Webhook-сервер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    # SIGTERM/SIGINT (docker stop, systemctl stop) завершают сервер штатно, чтобы
+    # успели сохраниться буферы: Telegram уже получил 200 и не пришлет обновления повторно
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with suppress(NotImplementedError):  # На Windows обработчики сигналов не поддерживаются
+            loop.add_signal_handler(sig, stop_event.set)
+    try:
+        await stop_event.wait()
+        logger.info("Получен сигнал остановки, webhook-сервер останавливается")
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            with suppress(NotImplementedError):
+                loop.remove_signal_handler(sig)
+        await runner.cleanup()